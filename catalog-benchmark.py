@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Runs generator stages against synthetic catalogs of the given sizes and
+reports time, peak memory and output size for every size.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+from math import pi, asin, sin, cos
+
+import geometry
+import spatial
+from classes import (
+    Location, LocationAltitude as Alt,
+    ServiceFlightContract, BusinessFlightContract,
+    TouristGroupFlightContract, CharterFlightContract,
+    CommercialFlightContract,
+)
+
+DEFAULT_STAGES = 'dist,waypoints,runways,landing-patterns,rewards,flight-plans,map,routes'
+
+MIN_ROUTE_DISTANCE = 50.0  # km
+MAX_ROUTE_DISTANCE = 0.5 * geometry.KERBIN_RADIUS * pi  # km
+RUNWAY_LENGTH = 2.5  # km
+HELIPAD_ONLY_SHARE = 0.25
+BEACONS_SHARE = 0.3
+
+# (contract class, weight, keyword arguments maker)
+CONTRACT_TYPES = [
+    (ServiceFlightContract, 3, lambda rnd: {
+        'objective': 'Transport our staff to the next base.',
+        'staff_type': rnd.choice(['Pilot', 'Engineer', 'Scientist']),
+    }),
+    (BusinessFlightContract, 2, lambda rnd: {
+        'objective': 'Transport @/VIK to the business meeting.',
+        'staff_type': rnd.choice(['Pilot', 'Engineer', 'Scientist']),
+        'reward': rnd.randrange(2000, 40000, 500),
+    }),
+    (TouristGroupFlightContract, 1, lambda rnd: {
+        'reward': rnd.randrange(3000, 12000, 500),
+    }),
+    (CharterFlightContract, 2, lambda rnd: {}),
+    (CommercialFlightContract, 2, lambda rnd: {}),
+]
+
+
+# ===== Synthetic catalog ===== #
+
+def _random_point(rnd, max_lat=75.0):
+    lat = geometry.rad_to_deg(asin(rnd.uniform(-1, 1)))
+    return (max(-max_lat, min(max_lat, lat)), rnd.uniform(-180, 180))
+
+
+def _offset(pt, hdg, dist):
+    """Returns the point at the distance (in kilometres) by the heading from pt."""
+    hdg = geometry.deg_to_rad(hdg)
+    towards = (pt[0] + cos(hdg), pt[1] + sin(hdg))
+    return tuple(geometry.step_to(pt, towards, dist))
+
+
+def make_locations(count, rnd):
+    """Returns the list of valid locations, some of them only have a helipad."""
+    locations = []
+    for num in xrange(count):
+        center = _random_point(rnd)
+        ground = round(rnd.uniform(0, 2000), 2)
+        params = {
+            'helipad': center + (Alt(1, ground),),
+            'staff_spawn': _offset(center, rnd.uniform(0, 360), 0.1) + (Alt(1, ground),),
+            'vip_spawn': _offset(center, rnd.uniform(0, 360), 0.2) + (Alt(1, ground),),
+            'launch_refund': rnd.choice([0, 5, 10, 25]),
+            'recovery_factor': rnd.choice([50, 60, 75]),
+        }
+        if rnd.random() >= HELIPAD_ONLY_SHARE:
+            hdg = rnd.uniform(0, 360)
+            runway_center = _offset(center, hdg + 90, 0.5)
+            ep1 = _offset(runway_center, hdg, -RUNWAY_LENGTH / 2)
+            ep2 = _offset(runway_center, hdg, RUNWAY_LENGTH / 2)
+            gs1 = rnd.choice([0, 0, 3, 5])
+            gs2 = rnd.choice([0, 3, 7.5, None])
+            params['runways'] = [(ep1 + (round(ground), gs1), ep2 + (round(ground), gs2))]
+            params['aircraft_launch'] = tuple(geometry.step_to(ep1, ep2, 0.1)) + (Alt(4, ground),)
+        locations.append(Location(
+            'Synthetic Base {:05}'.format(num),
+            'Synthetic base number {} for the benchmark.'.format(num),
+            **params
+        ))
+    return locations
+
+
+def make_beacons(count, rnd):
+    return {
+        'SYNTHETIC-{:05}-NDB'.format(num): _random_point(rnd) + (rnd.randrange(0, 4000, 100),)
+        for num in xrange(count)
+    }
+
+
+def make_routes(count, locations, beacons_index, rnd):
+    """
+    Returns dictionary of count valid routes of all contract types. Plane
+    routes partially get beacons near the middle of the route.
+    """
+    weights = [weight for _, weight, _ in CONTRACT_TYPES]
+    routes = {}
+    while len(routes) < count:
+        from_loc, to_loc = rnd.sample(locations, 2)
+        route = (from_loc.name, to_loc.name)
+        if route in routes:
+            continue
+        dist = geometry.distance(from_loc.position, to_loc.position)
+        if not MIN_ROUTE_DISTANCE < dist < MAX_ROUTE_DISTANCE:
+            continue
+
+        pick = rnd.uniform(0, sum(weights))
+        for contract_class, weight, make_kwargs in CONTRACT_TYPES:
+            pick -= weight
+            if pick <= 0:
+                break
+        kwargs = make_kwargs(rnd)
+        if from_loc.aircraft_launch and to_loc.runways and rnd.random() < BEACONS_SHARE:
+            middle = geometry.step_to(from_loc.position, to_loc.position, dist / 2)
+            kwargs['beacons'] = [name for _, name in beacons_index.nearest(middle, rnd.randint(1, 2))]
+        routes[route] = contract_class(**kwargs)
+    return routes
+
+
+def install_catalog(scale, seed):
+    """
+    Replaces the catalog of the generator by the synthetic one with scale
+    routes. Lists and dictionaries are changed in place, so all modules see
+    the new catalog.
+    """
+    import generator
+    from catalog import LOCATIONS, ROUTES, BEACONS
+    from registry import REGISTRY
+
+    rnd = random.Random(seed)
+    location_count = max(20, int(2 * scale ** 0.5))
+    LOCATIONS[:] = make_locations(location_count, rnd)
+    BEACONS.clear()
+    BEACONS.update(make_beacons(max(50, location_count), rnd))
+    spatial.reset_indices()
+    ROUTES.clear()
+    ROUTES.update(make_routes(scale, LOCATIONS, spatial.beacons_index(), rnd))
+    REGISTRY.reindex()
+    return generator
+
+
+# ===== Measurement ===== #
+
+def _dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def run_scale(options):
+    """Runs all stages for one scale in this process, prints JSON result."""
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    generator = install_catalog(options.run_scale, options.seed)
+    catalog_time = time.time() - start
+
+    out_dir = tempfile.mkdtemp(prefix='ksgap-benchmark-')
+    report_path = os.path.join(out_dir, 'profile.json')
+    sys.argv = [
+        'generator.py', '-d', out_dir, '--seed', str(options.seed), '--profile', report_path,
+        '--validate',  # the synthetic catalog is not remembered as validated
+    ]
+    sys.argv.extend('--' + stage for stage in options.stages.split(','))
+    try:
+        start = time.time()
+        generator.main()
+        total_time = time.time() - start
+        with open(report_path) as file:
+            profile = json.load(file)
+        output_size = _dir_size(out_dir) - os.path.getsize(report_path)
+    finally:
+        if options.keep:
+            print >> sys.stderr, 'Output is kept in {}'.format(out_dir)
+        else:
+            shutil.rmtree(out_dir)
+
+    sys.stdout = stdout
+    json.dump({
+        'routes': len(generator.ROUTES),
+        'locations': len(generator.LOCATIONS),
+        'beacons': len(generator.BEACONS),
+        'catalog_time': catalog_time,
+        'total_time': total_time,
+        'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'output_bytes': output_size,
+        'stages': {
+            step['name']: {'wall_time': step['wall_time'], 'bytes_written': step['bytes_written']}
+            for step in profile['steps']
+        },
+    }, sys.stdout)
+
+
+def print_results(results):
+    print '{:>8} {:>10} {:>12} {:>12}  {}'.format('Routes', 'Time, s', 'Memory, MB', 'Output, MB', 'Slowest stages')
+    for result in results:
+        slowest = sorted(result['stages'].iteritems(), key=(lambda item: -item[1]['wall_time']))[:3]
+        print '{:>8} {:>10.2f} {:>12.1f} {:>12.1f}  {}'.format(
+            result['routes'], result['total_time'],
+            result['peak_memory_kb'] / 1024.0, result['output_bytes'] / 1024.0 ** 2,
+            ', '.join('{} {:.2f}'.format(name, stage['wall_time']) for name, stage in slowest),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-s', '--scales', type=str, default='1000,10000,100000',
+        help='Comma-separated numbers of routes in synthetic catalogs.')
+    parser.add_argument('--stages', type=str, default=DEFAULT_STAGES,
+        help='Comma-separated generator options of stages to run.')
+    parser.add_argument('-o', '--output', type=str, default='catalog-benchmark.json',
+        help='Write JSON report to OUTPUT.')
+    parser.add_argument('--seed', type=int, default=1,
+        help='Seed for synthetic catalogs and contracts.')
+    parser.add_argument('--keep', action='store_true',
+        help='Keep generated files (their directories are printed).')
+    parser.add_argument('--run-scale', type=int, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.run_scale is not None:
+        run_scale(options)
+        return
+
+    results = []
+    for scale in [int(scale) for scale in options.scales.split(',')]:
+        print >> sys.stderr, 'Measuring {} routes'.format(scale)
+        # Every scale runs in a separate process to measure its peak memory.
+        command = [
+            sys.executable, os.path.abspath(__file__), '--run-scale', str(scale),
+            '--stages', options.stages, '--seed', str(options.seed),
+        ]
+        if options.keep:
+            command.append('--keep')
+        results.append(json.loads(subprocess.check_output(command)))
+
+    with open(options.output, 'w') as out:
+        json.dump({'seed': options.seed, 'results': results}, out, indent=2, sort_keys=True)
+    print_results(results)
+
+if __name__ == '__main__':
+    main()
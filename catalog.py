@@ -0,0 +1,80 @@
+"""
+Catalog of locations, routes and beacons. Large catalogs are loaded from the
+pickled cache when it matches sources of the catalog, otherwise they are built
+by their modules and the cache is written for the next start. Small catalogs
+are built faster than the cache is checked, so they are always built.
+"""
+
+import os
+import glob
+import hashlib
+import cPickle as pickle
+
+from beacons import BEACONS
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(SOURCE_DIR, '.cache')
+# Sources defining objects of the catalog.
+SOURCE_FILES = ('locations.py', 'routes.py', 'classes.py', 'runways.py', 'catalog.py')
+# Sources listing objects of the catalog, their size estimates its size.
+CATALOG_FILES = ('locations.py', 'routes.py')
+# Smaller catalogs are built faster than loaded from the cache.
+CACHE_MIN_SIZE = 48 * 1024  # bytes
+
+
+def _cache_path():
+    sources_hash = hashlib.sha1()
+    for name in SOURCE_FILES:
+        with open(os.path.join(SOURCE_DIR, name), 'rb') as file:
+            sources_hash.update(file.read())
+    return os.path.join(CACHE_DIR, 'catalog-{}.pickle'.format(sources_hash.hexdigest()))
+
+
+def _load_cache(path):
+    """Returns (locations, routes) from the cache or None if it is unusable."""
+    try:
+        with open(path, 'rb') as file:
+            locations, routes = pickle.load(file)
+    except (IOError, EOFError, ValueError, KeyError, IndexError, AttributeError, ImportError, pickle.UnpicklingError):
+        return None
+    # Random choices are made on construction, so every start has its own.
+    for contract in routes.itervalues():
+        contract.randomize()
+    return locations, routes
+
+
+def _save_cache(path, locations, routes):
+    """Writes the cache replacing stale ones, failures are not fatal."""
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        for stale_path in glob.glob(os.path.join(CACHE_DIR, 'catalog-*.pickle')):
+            os.remove(stale_path)
+        # Concurrent starts must not see a partially written cache.
+        temp_path = '{}.{}'.format(path, os.getpid())
+        with open(temp_path, 'wb') as out:
+            pickle.dump((locations, routes), out, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def _build():
+    from locations import LOCATIONS
+    from routes import ROUTES
+    return LOCATIONS, ROUTES
+
+
+def load():
+    """Returns (locations, routes) of the catalog."""
+    if sum(os.path.getsize(os.path.join(SOURCE_DIR, name)) for name in CATALOG_FILES) < CACHE_MIN_SIZE:
+        return _build()
+    path = _cache_path()
+    catalog = _load_cache(path)
+    if catalog is None:
+        catalog = _build()
+        _save_cache(path, *catalog)
+    return catalog
+
+
+LOCATIONS, ROUTES = load()
@@ -1,9 +1,8 @@
 import re
-from random import randint
-from itertools import chain
+import random
 
 import utils
-import geometry
+import runways as runway_catalog
 from beacons import BEACONS
 
 ICONS_PATH = 'ContractPacks/KerbinSideGAP/Icons/'
@@ -100,6 +99,7 @@ class Location(object):
         self.kk_base_name = kk_base_name
         self.runways = runways
         self.aircraft_launch_allowed_distance = aircraft_launch_allowed_distance
+        self._runway_ends = None
         if self.launch_refund is None:
             self.launch_refund = 0
         if self.recovery_factor is None:
@@ -108,17 +108,18 @@ class Location(object):
             self.aircraft_parking = self.aircraft_launch
         if self.kk_base_name is None:
             self.kk_base_name = self.name
-        if self.aircraft_launch is not None and self.runways is not None:
-            dist = geometry.distance(self.aircraft_launch, self.runways[0][0])
-            assert dist == min(
-                geometry.distance(self.aircraft_launch, pt)
-                for pt in chain.from_iterable(self.runways)
-            ), 'Mismatch aircraft_launch and runways for {}'.format(self.name)
 
     @property
     def position(self):
         return self.helipad or self.aircraft_launch
 
+    @property
+    def runway_ends(self):
+        """Runway ends allowed for landing, they are computed only once."""
+        if self._runway_ends is None:
+            self._runway_ends = runway_catalog.make_runway_ends(self)
+        return self._runway_ends
+
     @property
     def alphanum_name(self):
         return re.sub(r'[^a-zA-Z0-9]', '', self.name)
@@ -144,15 +145,24 @@ class Contract(object):
         @param objective Objective of the flight (displaying in description).
         @param special_notes Special notes about the flight (displaying under
                              objective as a separate paragraph).
-        @param beacons Beacons to visit when building flight plan.
+        @param beacons Names of beacons to visit when building flight plan.
         """
         self.objective = objective
         self.special_notes = special_notes
-        self.beacons = [(name, BEACONS[name]) for name in beacons] if beacons else []
+        self.beacon_names = list(beacons) if beacons else []
+        self._beacons = None
         self.waypoints = []
         self.from_loc = None
         self.to_loc = None
 
+    def randomize(self, rnd=random):
+        """
+        Makes generation-time random choices of the contract. Nothing to choose
+        by default, placeholder to redefine in subtypes.
+        @param rnd Source of random numbers (random module or random.Random).
+        """
+        pass
+
     @property
     def refund_amount(self):
         """
@@ -165,6 +175,20 @@ class Contract(object):
     def __str__(self):
         return '<{} from "{}" to "{}">'.format(self.__class__.__name__, self.from_loc, self.to_loc)
 
+    @property
+    def beacons(self):
+        """Beacons to visit as (name, point) pairs, resolved on first use."""
+        if self._beacons is None:
+            self._beacons = [(name, BEACONS[name]) for name in self.beacon_names]
+        return self._beacons
+
+    def get_location_errors(self, from_loc, to_loc):
+        """
+        Returns list of problems preventing the contract between the given
+        locations, no problems by default.
+        """
+        return []
+
     def set_locations(self, from_loc, to_loc):
         """
         Sets departure and destination of flight and some internal flags.
@@ -439,13 +463,18 @@ class ServiceFlightContract(TypedStaffContract):
         see https://github.com/jrossignol/ContractConfigurator/issues/401
         """
         super(ServiceFlightContract, self).__init__(**kwargs)
-        self.passengers_number = randint(*self.passengers_number)
+        self.randomize()
 
-    def set_locations(self, from_loc, to_loc):
-        """Performs additional check."""
-        super(ServiceFlightContract, self).set_locations(from_loc, to_loc)
-        assert self.from_loc.staff_spawn is not None, \
-            '{} is incorrect: origin base does not have staff spawn point'.format(self)
+    def randomize(self, rnd=random):
+        """Selects passengers number."""
+        self.passengers_number = rnd.randint(*ServiceFlightContract.passengers_number)
+
+    def get_location_errors(self, from_loc, to_loc):
+        """Checks staff spawn point."""
+        errors = super(ServiceFlightContract, self).get_location_errors(from_loc, to_loc)
+        if from_loc.staff_spawn is None:
+            errors.append('origin base does not have staff spawn point')
+        return errors
 
     def get_synopsis_notes(self):
         """Adds info about passengers count."""
@@ -528,11 +557,12 @@ class BusinessFlightContract(FixedRewardContract, TypedStaffContract):
     approx_launch_cost = 10000
     agent = 'Kerbal Aircraft Rent'
 
-    def set_locations(self, from_loc, to_loc):
-        """Performs additional check."""
-        super(BusinessFlightContract, self).set_locations(from_loc, to_loc)
-        assert self.from_loc.vip_spawn is not None, \
-            '{} is incorrect: origin base does not have VIP spawn point'.format(self)
+    def get_location_errors(self, from_loc, to_loc):
+        """Checks VIP spawn point."""
+        errors = super(BusinessFlightContract, self).get_location_errors(from_loc, to_loc)
+        if from_loc.vip_spawn is None:
+            errors.append('origin base does not have VIP spawn point')
+        return errors
 
     def get_rewards(self):
         return (0, self.reward, 1, 3)
@@ -0,0 +1,298 @@
+"""
+Compiler for the subset of Contract Configurator expressions used in contracts:
+arithmetic, comparisons, ternary operator, Random(a, b) and @/variables.
+"""
+
+import re
+import random
+
+import geometry
+
+TOKEN_REGEXP = re.compile(r'''
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+        | (?P<variable>@/[A-Za-z_]\w*)
+        | (?P<name>[A-Za-z_]\w*)
+        | (?P<operator>==|!=|<=|>=|[-+*/()?:,<>])
+    )
+''', re.VERBOSE)
+
+COMPARISONS = {
+    '==': (lambda fst, sec: fst == sec),
+    '!=': (lambda fst, sec: fst != sec),
+    '<': (lambda fst, sec: fst < sec),
+    '<=': (lambda fst, sec: fst <= sec),
+    '>': (lambda fst, sec: fst > sec),
+    '>=': (lambda fst, sec: fst >= sec),
+}
+
+_CACHE = {}
+
+
+def tokenize(text):
+    """Returns list of (kind, value) tokens of the expression."""
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = TOKEN_REGEXP.match(text, pos)
+        if match is None:
+            raise ValueError('Unexpected symbol at {} in "{}"'.format(pos, text))
+        kind = match.lastgroup
+        tokens.append((kind, float(match.group(kind)) if kind == 'number' else match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+class Parser(object):
+    """
+    Recursive descent parser. Nodes of the result tree are tuples, the first
+    item is the node type: 'number', 'variable', 'random', 'neg', arithmetic
+    operator, comparison operator or '?'.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def error(self, message):
+        return ValueError('{} in "{}"'.format(message, self.text))
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise self.error('Expected "{}"'.format(value) if value else 'Unexpected end')
+        self.pos += 1
+        return token
+
+    def parse(self):
+        tree = self.ternary()
+        if self.pos != len(self.tokens):
+            raise self.error('Unexpected "{}"'.format(self.peek()[1]))
+        return tree
+
+    def ternary(self):
+        cond = self.comparison()
+        if self.peek() != ('operator', '?'):
+            return cond
+        self.take('?')
+        if_true = self.ternary()
+        self.take(':')
+        return ('?', cond, if_true, self.ternary())
+
+    def comparison(self):
+        left = self.additive()
+        kind, value = self.peek()
+        if kind == 'operator' and value in COMPARISONS:
+            self.take()
+            return (value, left, self.additive())
+        return left
+
+    def additive(self):
+        left = self.term()
+        while self.peek() in (('operator', '+'), ('operator', '-')):
+            left = (self.take()[1], left, self.term())
+        return left
+
+    def term(self):
+        left = self.unary()
+        while self.peek() in (('operator', '*'), ('operator', '/')):
+            left = (self.take()[1], left, self.unary())
+        return left
+
+    def unary(self):
+        if self.peek() == ('operator', '-'):
+            self.take()
+            return ('neg', self.unary())
+        if self.peek() == ('operator', '+'):
+            self.take()
+            return self.unary()
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return ('number', value)
+        if kind == 'variable':
+            return ('variable', value[2:])
+        if kind == 'name' and value == 'Random':
+            self.take('(')
+            first = self.ternary()
+            self.take(',')
+            second = self.ternary()
+            self.take(')')
+            return ('random', first, second)
+        if (kind, value) == ('operator', '('):
+            inner = self.ternary()
+            self.take(')')
+            return inner
+        raise self.error('Unexpected "{}"'.format(value))
+
+
+def _mul_bounds(fst, sec):
+    products = [a * b for a in fst for b in sec]
+    return (min(products), max(products))
+
+
+def _div_bounds(fst, sec):
+    if sec[0] <= 0 <= sec[1]:
+        raise ValueError('Division by interval containing zero {}'.format(sec))
+    return _mul_bounds(fst, (1.0 / sec[1], 1.0 / sec[0]))
+
+
+def bounds(node, variables):
+    """
+    Returns (min, max) interval of the possible node values. Variables are
+    given by intervals of their values too.
+    """
+    kind = node[0]
+    if kind == 'number':
+        return (node[1], node[1])
+    if kind == 'variable':
+        if node[1] not in variables:
+            raise ValueError('Variable "@/{}" is unknown'.format(node[1]))
+        return variables[node[1]]
+    if kind == 'neg':
+        low, high = bounds(node[1], variables)
+        return (-high, -low)
+    if kind == '?':
+        cond = bounds(node[1], variables)
+        if cond == (True, True):
+            return bounds(node[2], variables)
+        if cond == (False, False):
+            return bounds(node[3], variables)
+        if_true, if_false = bounds(node[2], variables), bounds(node[3], variables)
+        return (min(if_true[0], if_false[0]), max(if_true[1], if_false[1]))
+
+    fst, sec = bounds(node[1], variables), bounds(node[2], variables)
+    if kind == 'random':
+        return (min(fst[0], sec[0]), max(fst[1], sec[1]))
+    if kind == '+':
+        return (fst[0] + sec[0], fst[1] + sec[1])
+    if kind == '-':
+        return (fst[0] - sec[1], fst[1] - sec[0])
+    if kind == '*':
+        return _mul_bounds(fst, sec)
+    if kind == '/':
+        return _div_bounds(fst, sec)
+    compare = COMPARISONS[kind]
+    results = set(compare(a, b) for a in fst for b in sec)
+    if kind in ('==', '!=') and (fst[0] != fst[1] or sec[0] != sec[1]):
+        # Ends of intervals give extremes for orders, but not for equality.
+        results.update((True, False))
+    return (min(results), max(results))
+
+
+def sample(node, variables, rnd=random):
+    """
+    Returns a random value of the node. Variables are given by their values,
+    Random(a, b) gives uniformly distributed number.
+    """
+    kind = node[0]
+    if kind == 'number':
+        return node[1]
+    if kind == 'variable':
+        if node[1] not in variables:
+            raise ValueError('Variable "@/{}" is unknown'.format(node[1]))
+        return variables[node[1]]
+    if kind == 'neg':
+        return -sample(node[1], variables, rnd)
+    if kind == '?':
+        branch = node[2] if sample(node[1], variables, rnd) else node[3]
+        return sample(branch, variables, rnd)
+
+    fst, sec = sample(node[1], variables, rnd), sample(node[2], variables, rnd)
+    if kind == 'random':
+        return rnd.uniform(fst, sec)
+    if kind == '+':
+        return fst + sec
+    if kind == '-':
+        return fst - sec
+    if kind == '*':
+        return fst * sec
+    if kind == '/':
+        return fst / sec
+    return COMPARISONS[kind](fst, sec)
+
+
+def sample_array(node, variables, count, rnd):
+    """
+    Returns NumPy array of count random values of the node at once. Variables
+    are given by arrays of their values, rnd is numpy.random.RandomState.
+    """
+    numpy = geometry.get_numpy()
+    if numpy is None:
+        raise ImportError('Package "numpy" is required to sample expressions')
+    return _sample_array(numpy, node, variables, count, rnd)
+
+
+def _sample_array(numpy, node, variables, count, rnd):
+    kind = node[0]
+    if kind == 'number':
+        return numpy.full(count, node[1])
+    if kind == 'variable':
+        if node[1] not in variables:
+            raise ValueError('Variable "@/{}" is unknown'.format(node[1]))
+        return numpy.asarray(variables[node[1]], dtype=float)
+    if kind == 'neg':
+        return -_sample_array(numpy, node[1], variables, count, rnd)
+    if kind == '?':
+        return numpy.where(
+            _sample_array(numpy, node[1], variables, count, rnd),
+            _sample_array(numpy, node[2], variables, count, rnd),
+            _sample_array(numpy, node[3], variables, count, rnd),
+        )
+
+    fst = _sample_array(numpy, node[1], variables, count, rnd)
+    sec = _sample_array(numpy, node[2], variables, count, rnd)
+    if kind == 'random':
+        return rnd.uniform(fst, sec)
+    if kind == '+':
+        return fst + sec
+    if kind == '-':
+        return fst - sec
+    if kind == '*':
+        return fst * sec
+    if kind == '/':
+        return fst / sec
+    return COMPARISONS[kind](fst, sec)
+
+
+class Expression(object):
+    """Compiled expression."""
+
+    def __init__(self, text):
+        self.text = text
+        self.tree = Parser(text).parse()
+
+    def bounds(self, variables):
+        return bounds(self.tree, variables)
+
+    def min(self, variables):
+        return self.bounds(variables)[0]
+
+    def max(self, variables):
+        return self.bounds(variables)[1]
+
+    def sample(self, variables, rnd=random):
+        return sample(self.tree, variables, rnd)
+
+    def sample_array(self, variables, count, rnd):
+        return sample_array(self.tree, variables, count, rnd)
+
+    def __str__(self):
+        return '<Expression "{}">'.format(self.text)
+
+
+def compile_expression(text):
+    """Returns compiled expression, every text is compiled only once."""
+    expression = _CACHE.get(text)
+    if expression is None:
+        expression = _CACHE[text] = Expression(text)
+    return expression
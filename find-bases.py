@@ -6,6 +6,7 @@ import re
 import sys
 import argparse
 
+import utils
 import geometry
 
 GUARANTEED_CLEAR_ALTITUDE = 500
@@ -20,14 +21,14 @@ class LaunchSiteFinder(object):
     ]
 
     @staticmethod
-    def matches(config):
+    def matches(params):
         """
         Heuristic function to determine whether config defines a launch site.
         """
         return (
-            'RocketPad' not in config
-            and re.search(r'\sLaunchSiteName = \S', config) is not None
-            and re.search(r'\sLaunchPadTransform = \S', config) is not None
+            not any('RocketPad' in value for value in params.itervalues())
+            and params.get('LaunchSiteName')
+            and params.get('LaunchPadTransform')
         )
 
     @staticmethod
@@ -79,14 +80,14 @@ class LaunchSiteFinder(object):
 
 class RocketPadFinder(LaunchSiteFinder):
     @staticmethod
-    def matches(config):
+    def matches(params):
         """
         Heuristic function to determine whether config defines a rocket pad.
         """
         return (
-            'RocketPad' in config
-            and re.search(r'\sLaunchSiteName = \S', config) is not None
-            and re.search(r'\sLaunchPadTransform = \S', config) is not None
+            any('RocketPad' in value for value in params.itervalues())
+            and params.get('LaunchSiteName')
+            and params.get('LaunchPadTransform')
         )
 
 
@@ -94,11 +95,11 @@ class BeaconFinder(object):
     patterns = ['Group', 'FacilityType', 'RadialPosition', 'RadiusOffset']
 
     @staticmethod
-    def matches(config):
+    def matches(params):
         """
         Heuristic function to determine whether config defines a beacon.
         """
-        return re.search(r'\sFacilityType = (Tracking|Radar)Station', config) is not None
+        return params.get('FacilityType') in ('TrackingStation', 'RadarStation')
 
     @staticmethod
     def format(groups):
@@ -128,6 +129,17 @@ def find_configs(dir):
     return configs
 
 
+def flatten_config(node):
+    """Returns list of all (param, value) pairs from the config tree."""
+    params = []
+    for param, value in node:
+        if isinstance(value, list):
+            params.extend(flatten_config(value))
+        else:
+            params.append((param, value))
+    return params
+
+
 def group_bases(all_bases):
     """Groups bases to a dictionary by 'Group' parameter."""
     groups = {}
@@ -164,19 +176,15 @@ def main():
     finder = finders[options.finder]
     for name in configs:
         with open(name) as file:
-            config = file.read()
-        if finder.matches(config):
-            site_info = (
-                line.strip() for line in config.split('\n')
-                if any(pattern in line for pattern in finder.patterns)
-            )
+            params = flatten_config(utils.iter_read_config(file))
+        if finder.matches(dict(params)):
+            site_info = [(param, value) for param, value in params if param in finder.patterns]
             if options.preformat:
-                bases.append(dict(
-                    [s.strip() for s in line.split('=')]
-                    for line in site_info
-                ))
+                bases.append(dict(site_info))
             else:
-                print '{}:\n\t{}\n'.format(name, '\n\t'.join(site_info))
+                print '{}:\n\t{}\n'.format(
+                    name, '\n\t'.join('{} = {}'.format(param, value) for param, value in site_info),
+                )
     if options.preformat:
         print finder.format(group_bases(bases))
 
@@ -2,8 +2,7 @@ from math import tan
 
 import utils
 import geometry
-
-METERS_PER_KILOMETER = 1000
+from runways import METERS_PER_KILOMETER, IAF_DISTANCE
 
 ASC_TANG = tan(geometry.deg_to_rad(10.0)) * METERS_PER_KILOMETER
 DESC_TANG = tan(geometry.deg_to_rad(10.0)) * METERS_PER_KILOMETER
@@ -11,13 +10,7 @@ DESC_TANG = tan(geometry.deg_to_rad(10.0)) * METERS_PER_KILOMETER
 TAKEOFF_ALTITUDE = 0.1 * ASC_TANG
 TAKEOFF_STRAIGHT_UNTIL_ALTITUDE = 1500
 
-MIN_GLIDESLOPE_ANGLE = 3.3
 MIN_IAF_LEVEL_DISTANCE = 3.0
-IAF_DISTANCE = 25.0
-FAF_DISTANCE = 10.0
-FLARE_DISTANCE = 0.2
-
-GLIDESLOPE_ALTITUDE_CORRECTION = 75 * tan(geometry.deg_to_rad(MIN_GLIDESLOPE_ANGLE))
 
 
 def point_to_params(name, pt, alt=None, marker=None):
@@ -36,16 +29,15 @@ def point_to_params(name, pt, alt=None, marker=None):
     return params
 
 
-def make_landing_pattern(landing_point, opposite_end):
-    """Makes waypoints for landing in Kramax AutoPilot format."""
-    iaf_point, iaf_alt = _make_glideslope_point(landing_point, opposite_end, IAF_DISTANCE)
-    faf_point, faf_alt = _make_glideslope_point(landing_point, opposite_end, FAF_DISTANCE)
-    flare_point, flare_alt = _make_glideslope_point(landing_point, opposite_end, FLARE_DISTANCE)
+def make_landing_pattern(runway_end):
+    """Makes waypoints for landing to the runway end in Kramax AutoPilot format."""
+    (iaf_point, iaf_alt), (faf_point, faf_alt), (flare_point, flare_alt) = \
+        runway_end.iaf, runway_end.faf, runway_end.flare
     return [
         point_to_params('IAF', iaf_point, alt=iaf_alt, marker='IAF'),
         point_to_params('FAF', faf_point, alt=faf_alt, marker='FAF'),
         point_to_params('FLARE', flare_point, alt=flare_alt, marker='RW'),
-        point_to_params('STOP', opposite_end, marker='Stop'),
+        point_to_params('STOP', runway_end.opposite_end, marker='Stop'),
     ]
 
 
@@ -96,18 +88,13 @@ def make_route_waypoints(from_loc, to_loc, flight_level, beacons):
     points.append(point_to_params('ASCENT', position))
 
     last_beacon_position = beacons[-1][1] if beacons else position
-    landing_point, opposite_end = utils.select_runway(to_loc, last_beacon_position)
+    runway_end = utils.select_runway_end(to_loc, last_beacon_position)
+    landing_point, opposite_end = runway_end.landing_point, runway_end.opposite_end
+    (iaf_point, iaf_alt), (faf_point, faf_alt), (flare_point, flare_alt) = \
+        runway_end.iaf, runway_end.faf, runway_end.flare
 
-    iaf_point, iaf_alt = _make_glideslope_point(landing_point, opposite_end, IAF_DISTANCE)
-    faf_point, faf_alt = _make_glideslope_point(landing_point, opposite_end, FAF_DISTANCE)
-    flare_point, flare_alt = _make_glideslope_point(landing_point, opposite_end, FLARE_DISTANCE)
-
-    beacon_distances = []
-    dist_position = runway[1]
-    for _, beacon in beacons:
-        beacon_distances.append(geometry.distance(dist_position, beacon))
-        dist_position = beacon
-    beacon_distances.append(geometry.distance(dist_position, landing_point))
+    route_points = [runway[1]] + [beacon for _, beacon in beacons] + [landing_point]
+    beacon_distances = list(geometry.distances(route_points[:-1], route_points[1:]))
 
     if not beacons:
         asc_dist = (flight_level - position[2] - 0.1) / ASC_TANG
@@ -145,16 +132,3 @@ def make_route_waypoints(from_loc, to_loc, flight_level, beacons):
     points.append(point_to_params('FLARE', flare_point, alt=flare_alt, marker='RW'))
     points.append(point_to_params('STOP', opposite_end, marker='Stop'))
     return points, beacon_distances
-
-
-def _get_glideslope_tang(landing_point):
-    return METERS_PER_KILOMETER * tan(
-        geometry.deg_to_rad(max(MIN_GLIDESLOPE_ANGLE, landing_point[3]))
-    )
-
-
-def _make_glideslope_point(landing_point, opposite_end, distance):
-    glideslope_tang = _get_glideslope_tang(landing_point)
-    alt = landing_point[2] + distance * glideslope_tang + GLIDESLOPE_ALTITUDE_CORRECTION
-    point = geometry.step_to(landing_point, opposite_end, -distance)
-    return point, alt
@@ -3,8 +3,20 @@
 """Generates contract files based on locations and routes."""
 
 import os
-import re
+import sys
+import json
+import random
+import hashlib
 import argparse
+import StringIO
+import tempfile
+import collections
+import multiprocessing
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 try:
     import svgwrite
@@ -12,30 +24,190 @@ except ImportError:
     svgwrite = None
 
 import utils
+import spatial
+import profiling
 import geometry
+import runways
 import flightplan
+import planner
+import validation
+from registry import REGISTRY, POINT_TYPES
 from classes import DEFAULT_AGENT
-from locations import LOCATIONS
-from beacons import BEACONS
-from routes import ROUTES
+from catalog import LOCATIONS, ROUTES, BEACONS
 
 CFG_FILE_HEADER = """\
 // This file was automatically generated via Kerbin Side GAP contracts generator.
 // Do not edit it manually, all changes will be lost. Edit generator instead and rerun it to get the new file.
 """
 
+MANIFEST_FILE = '.ksgap-manifest.json'
+MANIFEST_VERSION = 1
+# Incremental builds need stable random choices of contracts.
+INCREMENTAL_SEED = 0
+# Sources defining how contracts are compiled, routes and locations are
+# fingerprinted separately for every contract.
+CODE_FILES = ('generator.py', 'classes.py', 'utils.py', 'geometry.py', 'expressions.py')
+_SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+_CODE_HASH = []
+
+
+def _published_runway_ends(options):
+    """Returns runway ends published in runway files and landing patterns."""
+    return [
+        runway_end
+        for runway_end in _product('runways', options)
+        if runway_end.location_name != "Kerbal Space Centre"
+    ]
 
-def _for_all_runways(callback):
-    """Applies a callback to all allowed runways of all locations."""
-    for loc in LOCATIONS:
-        if not loc.runways or loc.name == "Kerbal Space Centre":
-            continue
-        for runway_num, (ep1, ep2) in enumerate(loc.runways):
-            for gs_pt, loc_pt in [(ep1, ep2), (ep2, ep1)]:
-                if gs_pt[3] is None:
-                    continue
-                callback(loc, runway_num, gs_pt, loc_pt)
-    return None
+
+def _pin_catalog_points():
+    """Caches unit vectors of all named points of locations and beacons."""
+    geometry.UNIT_VECTORS.pin(BEACONS.itervalues())
+    REGISTRY.warm()
+
+
+def _route_random(seed, route):
+    """
+    Returns the source of random numbers for the route derived from the seed,
+    so choices for one contract do not depend on other routes.
+    """
+    return random.Random(int(hashlib.sha1('{}:{}'.format(seed, route)).hexdigest(), 16))
+
+
+def _route_contract(route):
+    """Returns the contract of the route with its locations set."""
+    return _product('contracts')[route]
+
+
+def _map_routes(options, func, routes=None):
+    """
+    Applies func to every route key (all routes by default), in the pool of
+    options.jobs processes if it is greater than one. Returns (route, result)
+    pairs in the order of routes (sorted by default), so the output does not
+    depend on the number of jobs. Workers must be forked to share products
+    and random choices of this process (see main).
+    """
+    if routes is None:
+        routes = sorted(ROUTES)
+    if options.jobs <= 1 or len(routes) < 2:
+        return zip(routes, map(func, routes))
+    pool = multiprocessing.Pool(options.jobs)
+    try:
+        return zip(routes, pool.map(func, routes, chunksize=max(1, len(routes) // (4 * options.jobs))))
+    finally:
+        pool.close()
+        pool.join()
+
+
+# ===== Manifest of generated files for incremental builds ===== #
+
+def _plain(value):
+    """Converts an object to the structure of builtin types to fingerprint it."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_plain(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _plain(item)) for key, item in value.iteritems()))
+    if hasattr(value, '__dict__'):
+        # Private attributes are caches, they do not change the result.
+        attributes = {key: item for key, item in vars(value).iteritems() if not key.startswith('_')}
+        return (value.__class__.__name__, _plain(attributes))
+    return value
+
+
+def _code_hash():
+    """Returns the hash of all sources the contracts are compiled by."""
+    if not _CODE_HASH:
+        _CODE_HASH.append(utils.files_hash(os.path.join(_SOURCE_DIR, name) for name in CODE_FILES))
+    return _CODE_HASH[0]
+
+
+def _contract_fingerprint(contract):
+    """
+    Returns the hash of everything the contract file depends on: the contract
+    itself, its locations, beacons and the generator code.
+    """
+    return hashlib.sha1(_code_hash() + repr(_plain(contract))).hexdigest()
+
+
+def _file_hash(name):
+    """Returns the hash of the file contents or None if there is no file."""
+    if not os.path.exists(name):
+        return None
+    with open(name, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def _load_manifest():
+    """Returns files of the manifest (name -> input and output hashes)."""
+    try:
+        with open(MANIFEST_FILE) as file:
+            manifest = json.load(file)
+    except (IOError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['files']
+
+
+def _save_manifest(files):
+    with open(MANIFEST_FILE, 'w') as out:
+        json.dump({'version': MANIFEST_VERSION, 'files': files}, out, indent=1, sort_keys=True)
+
+
+# ===== Intermediate products shared by stages ===== #
+
+_PRODUCTS = {}
+
+
+def _product(name, options=None):
+    """
+    Returns the intermediate product, it is made only once per process. The
+    scheduler makes all products needed by stages before forking workers.
+    """
+    if name not in _PRODUCTS:
+        _PRODUCTS[name] = PRODUCERS[name](options)
+    return _PRODUCTS[name]
+
+
+def _produce_contracts(options):
+    """Contracts of all routes with locations set (route -> contract, sorted by route)."""
+    contracts = collections.OrderedDict()
+    for route, contract in sorted(ROUTES.iteritems()):
+        contract.set_locations(REGISTRY[route[0]], REGISTRY[route[1]])
+        contracts[route] = contract
+    return contracts
+
+
+def _produce_runways(options):
+    """Runway ends of all locations, shared by runways, patterns and plans."""
+    return runways.RunwayCatalog(LOCATIONS)
+
+
+def _make_route_path(route, beacons=False):
+    """Returns SVG path data of the route arrow or None if it is not drawn."""
+    contract = _route_contract(route)
+    if beacons and not contract.plane_allowed:
+        return None
+    return utils.route_arrow_path(
+        contract.from_loc, contract.to_loc,
+        beacons=(contract.beacons if beacons else None),
+    )
+
+
+def _make_beacon_route_path(route):
+    return _make_route_path(route, beacons=True)
+
+
+def _produce_route_paths(options):
+    """SVG path data of the route arrows for the map (route -> path data)."""
+    return dict(_map_routes(options, _make_beacon_route_path if options.beacons else _make_route_path))
+
+
+PRODUCERS = {
+    'contracts': _produce_contracts,
+    'runways': _produce_runways,
+    'route_paths': _produce_route_paths,
+}
 
 
 def _make_kramax_patch(plans_list):
@@ -48,20 +220,50 @@ def _make_kramax_patch(plans_list):
 
 
 def make_distance_table(options):
-    """Makes .csv table with distances between all locations."""
+    """
+    Makes .csv table with distances between all locations. Only the upper
+    triangle of the matrix is calculated, the lower one is mirrored. Matrix is
+    kept in the memory-mapped .npy file (temporary one unless options.dist_npy
+    is given) and the table is written row by row.
+    """
     print 'Location distances table is generating'
-    rows = [['Distances']]
-    for loc1 in LOCATIONS:
-        row = [loc1.name]
-        rows[0].append(loc1.name)
-        for loc2 in LOCATIONS:
-            dist = utils.loc_distance(loc1, loc2)
-            row.append(str(round(dist, 2)))
-        rows.append(row)
+    names = [loc.name for loc in LOCATIONS]
+    count = len(names)
+    if numpy is None:
+        if options.dist_npy is not None:
+            print 'Package "numpy" is required to save distances matrix!'
+        matrix = [[0.0] * count for _ in xrange(count)]
+        npy_path = None
+    else:
+        npy_path = options.dist_npy
+        if npy_path is None:
+            npy_fd, npy_path = tempfile.mkstemp(suffix='.npy')
+            os.close(npy_fd)
+        matrix = numpy.lib.format.open_memmap(npy_path, mode='w+', dtype=float, shape=(count, count))
+
     if options.verbose > 1:
         print 'Writing file Distances.csv'
-    with open('Distances.csv', 'w') as out:
-        out.write('\n'.join([','.join(row) for row in rows]) + '\n')
+    try:
+        with open('Distances.csv', 'w') as out:
+            out.write(','.join(['Distances'] + names) + '\n')
+            rows = geometry.upper_distance_rows([loc.position for loc in LOCATIONS])
+            for index, upper in enumerate(rows):
+                matrix[index][index] = 0.0
+                matrix[index][index + 1:] = upper
+                if numpy is None:
+                    for other, dist in enumerate(upper, index + 1):
+                        matrix[other][index] = dist
+                else:
+                    matrix[index + 1:, index] = upper
+                row = matrix[index] if numpy is None else matrix[index].tolist()
+                out.write(','.join([names[index]] + [str(round(dist, 2)) for dist in row]) + '\n')
+    finally:
+        if numpy is not None:
+            del matrix
+            if options.dist_npy is None:
+                os.remove(npy_path)
+            elif options.verbose > 1:
+                print 'Writing file {}'.format(npy_path)
 
 
 def make_locations_waypoints(options):
@@ -70,7 +272,7 @@ def make_locations_waypoints(options):
     waypoints = []
     index = 0
     for loc in LOCATIONS:
-        for point_type in ('helipad', 'aircraft_launch', 'aircraft_parking', 'staff_spawn', 'vip_spawn'):
+        for point_type in POINT_TYPES:
             point = getattr(loc, point_type)
             if point is None or (point_type == 'aircraft_parking' and point == loc.aircraft_launch):
                 continue
@@ -91,43 +293,30 @@ def make_locations_waypoints(options):
 def make_locations_runways(options):
     """Makes .rwy file with all runways in NavUtilities format."""
     print 'Runways for locations are generating'
-    runways = {}
-
-    @_for_all_runways
-    def _(loc, runway_num, gs_pt, loc_pt):
-        hdg = geometry.heading(gs_pt, loc_pt)
-        hdg_str = '{:02}'.format(int(round(hdg / 10)))
-        name = '{} {}'.format(re.sub(r'[^a-zA-Z0-9 ]', '°', loc.name), hdg_str)
-        if gs_pt[3] > 0:
-            name = '{} gs {}'.format(name, gs_pt[3])
-        short_name = '{}{}'.format(
-            ''.join(word[0] for word in re.sub(r'([A-Z])', r' \1', loc.name).split()),
-            hdg_str,
-        )
-        runway_key = (loc.name, runway_num)
-        runways.setdefault(runway_key, {})[name] = [
+    config = []
+    runway_ends = sorted(
+        _published_runway_ends(options),
+        key=(lambda runway_end: (runway_end.location_name, runway_end.runway_num, runway_end.ident)),
+    )
+    for runway_end in runway_ends:
+        landing_point, opposite_end = runway_end.landing_point, runway_end.opposite_end
+        params = [
             ('body', 'Kerbin'),
-            ('ident', name),
-            ('shortID', short_name),
-            ('hdg', round(hdg, 2)),
-            ('altMSL', gs_pt[2]),
-            ('gsLatitude', gs_pt[0]),
-            ('gsLongitude', gs_pt[1]),
-            ('locLatitude', loc_pt[0]),
-            ('locLongitude', loc_pt[1]),
+            ('ident', runway_end.ident),
+            ('shortID', runway_end.short_ident),
+            ('hdg', round(runway_end.heading, 2)),
+            ('altMSL', landing_point[2]),
+            ('gsLatitude', landing_point[0]),
+            ('gsLongitude', landing_point[1]),
+            ('locLatitude', opposite_end[0]),
+            ('locLongitude', opposite_end[1]),
             ('outerMarkerDist', 10000),
             ('middleMarkerDist', 2200),
             ('innerMarkerDist', 200),
         ]
-
-    config = []
-    for runway_key in sorted(runways):
-        loc_runways = runways[runway_key]
-        if len(loc_runways) == 2:
-            names = loc_runways.keys()
-            loc_runways[names[0]].append(('identOfOpposite', names[1]))
-            loc_runways[names[1]].append(('identOfOpposite', names[0]))
-        config.extend(('Runway', loc_runways[name]) for name in sorted(loc_runways))
+        if runway_end.opposite_ident is not None:
+            params.append(('identOfOpposite', runway_end.opposite_ident))
+        config.append(('Runway', params))
     if options.verbose > 1:
         print 'Writing file KerbinSideRunways.rwy'
     with open('KerbinSideRunways.rwy', 'w') as out:
@@ -139,15 +328,12 @@ def make_landing_patterns(options):
     """Makes .cfg file with all landing patterns for Kramax AutoPilot."""
     print 'Landing patterns are generating'
     landing_patterns = {}
-
-    @_for_all_runways
-    def _(loc, runway_num, gs_pt, loc_pt):
-        hdg = geometry.heading(gs_pt, loc_pt)
-        name = 'Landing {} {:02}'.format(loc.name, int(round(hdg / 10)))
+    for runway_end in _published_runway_ends(options):
+        name = 'Landing {} {:02}'.format(runway_end.location_name, int(round(runway_end.heading / 10)))
         description = 'Plan for landing to the {} with heading {}°'.format(
-            loc.name, int(round(hdg)),
+            runway_end.location_name, int(round(runway_end.heading)),
         )
-        waypoints = flightplan.make_landing_pattern(gs_pt, loc_pt)
+        waypoints = flightplan.make_landing_pattern(runway_end)
         landing_patterns[name] = [
             ('name', name),
             ('description', description),
@@ -163,69 +349,134 @@ def make_landing_patterns(options):
         utils.write_config(out, _make_kramax_patch(plans_list))
 
 
+def _make_reward_row(route):
+    """Returns the row of reward table and the reward string of the route."""
+    contract = _route_contract(route)
+    advance_funds, reward_funds, _, _ = contract.get_rewards()
+    reward_str = '{} + ({} + {}) * Random(1.0, 1.15)'.format(
+        advance_funds, reward_funds, contract.refund_amount,
+    )
+    min_reward, max_reward = utils.calculate_reward_bounds(contract, reward_str)
+    row = [
+        contract.__class__.__name__,
+        contract.from_loc.name,
+        contract.to_loc.name,
+        str(round(utils.loc_distance(contract.from_loc, contract.to_loc), 2)),
+        str(min_reward),
+        str(max_reward),
+    ]
+    return row, reward_str
+
+
 def make_reward_table(options):
     """Makes .csv table with rewards for all contracts."""
     print 'Reward table is generating'
-    locations_dict = {loc.name: loc for loc in LOCATIONS}
     rows = [['Class', 'Departure', 'Destination', 'Distance', 'Min reward', 'Max reward']]
-    for route, contract in ROUTES.iteritems():
-        contract.set_locations(locations_dict[route[0]], locations_dict[route[1]])
-        advance_funds, reward_funds, _, _ = contract.get_rewards()
-
+    reward_strings = []
+    for route, (row, reward_str) in _map_routes(options, _make_reward_row):
+        contract = _route_contract(route)
         if options.verbose > 0:
             print 'Calculating reward for {}'.format(contract)
-        reward_str = '{} + ({} + {}) * Random(1.0, 1.15)'.format(
-            advance_funds, reward_funds, contract.refund_amount,
-        )
-        min_reward = utils.calculate_reward(contract, reward_str, calc_min=True)
-        max_reward = utils.calculate_reward(contract, reward_str, calc_min=False)
-
-        rows.append([
-            contract.__class__.__name__,
-            contract.from_loc.name,
-            contract.to_loc.name,
-            str(round(utils.loc_distance(contract.from_loc, contract.to_loc), 2)),
-            str(min_reward),
-            str(max_reward),
-        ])
+        reward_strings.append((contract, reward_str))
+        rows.append(row)
     if options.verbose > 1:
         print 'Writing file Rewards.csv'
     with open('Rewards.csv', 'w') as out:
         out.write('\n'.join([','.join(row) for row in rows]) + '\n')
 
+    if options.reward_samples:
+        make_reward_distribution(options, reward_strings)
+
+
+def make_reward_distribution(options, reward_strings):
+    """
+    Makes .csv table with Monte Carlo distribution of rewards for every
+    contract class. Takes the list of (contract, reward string) pairs.
+    """
+    if numpy is None:
+        print 'Package "numpy" is required to make reward distribution!'
+        return
+
+    print 'Reward distribution is sampling'
+    rnd = numpy.random.RandomState(options.seed)
+    rewards = {}
+    rewards_per_km = {}
+    for contract, reward_str in reward_strings:
+        samples = utils.sample_rewards(contract, reward_str, options.reward_samples, rnd)
+        contract_class = contract.__class__.__name__
+        rewards.setdefault(contract_class, []).append(samples)
+        rewards_per_km.setdefault(contract_class, []).append(
+            samples / utils.loc_distance(contract.from_loc, contract.to_loc)
+        )
+
+    percentiles = [5, 25, 50, 75, 95]
+    rows = [
+        ['Class', 'Routes', 'Mean reward']
+        + ['P{} reward'.format(percentile) for percentile in percentiles]
+        + ['Mean reward per km', 'P5 reward per km', 'P95 reward per km'],
+    ]
+    for contract_class in sorted(rewards):
+        class_rewards = numpy.concatenate(rewards[contract_class])
+        class_rewards_per_km = numpy.concatenate(rewards_per_km[contract_class])
+        rows.append(
+            [contract_class, str(len(rewards[contract_class])), str(round(class_rewards.mean(), 2))]
+            + [str(round(value, 2)) for value in numpy.percentile(class_rewards, percentiles)]
+            + [str(round(value, 2)) for value in [
+                class_rewards_per_km.mean(),
+                numpy.percentile(class_rewards_per_km, 5),
+                numpy.percentile(class_rewards_per_km, 95),
+            ]]
+        )
+    if options.verbose > 1:
+        print 'Writing file RewardDistribution.csv'
+    with open('RewardDistribution.csv', 'w') as out:
+        out.write('\n'.join([','.join(row) for row in rows]) + '\n')
+
+
+def _make_flight_plan(route):
+    """
+    Returns the name of the flight plan of the route, the plan itself and the
+    info about beacon distances. Returns None if planes are not allowed.
+    """
+    contract = _route_contract(route)
+    if not contract.plane_allowed:
+        return None
+    from_loc = contract.from_loc
+    to_loc = contract.to_loc
+    name = '{} -> {}'.format(from_loc.name, to_loc.name)
+    description = 'Plan for {} flight from the {} to the {}.'.format(
+        contract.get_flight_type(), from_loc.name, to_loc.name,
+    )
+    waypoints, beacon_distances = flightplan.make_route_waypoints(
+        from_loc, to_loc, contract.flight_level, contract.beacons,
+    )
+    distance_info = {
+        'name': name,
+        'type': contract.get_flight_type(),
+        'straight': utils.loc_distance(from_loc, to_loc),
+        'max': max(beacon_distances),
+        'sum': sum(beacon_distances),
+    }
+    flight_plan = [
+        ('name', name),
+        ('description', description),
+        ('planet', 'Kerbin'),
+        ('WayPoints', [('WayPoint', waypoint) for waypoint in waypoints]),
+    ]
+    return name, flight_plan, distance_info
+
 
 def make_flight_plans(options):
     """Makes .cfg file with flight plans for Kramax AutoPilot."""
     print 'Flight plans are generating'
-    locations_dict = {loc.name: loc for loc in LOCATIONS}
     flight_plans = {}
     distances = []
-    for route, contract in ROUTES.iteritems():
-        from_loc = locations_dict[route[0]]
-        to_loc = locations_dict[route[1]]
-        contract.set_locations(from_loc, to_loc)
-        if not contract.plane_allowed:
+    for _, result in _map_routes(options, _make_flight_plan):
+        if result is None:
             continue
-        name = '{} -> {}'.format(from_loc.name, to_loc.name)
-        description = 'Plan for {} flight from the {} to the {}.'.format(
-            contract.get_flight_type(), from_loc.name, to_loc.name,
-        )
-        waypoints, beacon_distances = flightplan.make_route_waypoints(
-            from_loc, to_loc, contract.flight_level, contract.beacons,
-        )
-        distances.append({
-            'name': name,
-            'type': contract.get_flight_type(),
-            'straight': utils.loc_distance(from_loc, to_loc),
-            'max': max(beacon_distances),
-            'sum': sum(beacon_distances),
-        })
-        flight_plans[name] = [
-            ('name', name),
-            ('description', description),
-            ('planet', 'Kerbin'),
-            ('WayPoints', [('WayPoint', waypoint) for waypoint in waypoints]),
-        ]
+        name, flight_plan, distance_info = result
+        flight_plans[name] = flight_plan
+        distances.append(distance_info)
     plans_list = [('FlightPlan', flight_plans[name]) for name in sorted(flight_plans)]
     if options.verbose > 1:
         print 'Writing file KerbinSideGapFlightPlans.cfg'
@@ -243,6 +494,27 @@ def make_flight_plans(options):
             )
 
 
+def make_beacon_plans(options):
+    """Proposes beacons for the flight plans of all plane routes."""
+    print 'Beacon plans are generating'
+    plane_routes = [
+        contract for contract in _product('contracts').itervalues()
+        if contract.plane_allowed
+    ]
+
+    proposals = planner.plan_routes(
+        (contract.from_loc, contract.to_loc) for contract in plane_routes
+    )
+    for contract, proposal in sorted(zip(plane_routes, proposals), key=(lambda pair: str(pair[0]))):
+        current = [name for name, _ in contract.beacons]
+        if proposal is None:
+            print 'No path found for {}'.format(contract)
+        elif proposal != current or options.verbose > 0:
+            print 'Proposed beacons for {}: {} (now {})'.format(
+                contract, ', '.join(proposal) or 'none', ', '.join(current) or 'none',
+            )
+
+
 def make_route_map(options):
     """Makes .svg map with all locations and routes."""
     if svgwrite is None:
@@ -250,22 +522,18 @@ def make_route_map(options):
         return
 
     print 'Routes map is generating'
-    locations_dict = {loc.name: loc for loc in LOCATIONS}
     name = 'FlightPlans.svg' if options.beacons else 'Routes.svg'
     route_map = svgwrite.Drawing(name, size=(utils.MAP_WIDTH, utils.MAP_HEIGHT))
 
-    for route, contract in ROUTES.iteritems():
-        from_loc = locations_dict[route[0]]
-        to_loc = locations_dict[route[1]]
-        contract.set_locations(from_loc, to_loc)
-        if options.beacons and not contract.plane_allowed:
+    route_paths = _product('route_paths', options)
+    # Common attributes of route arrows are set once by their group.
+    routes_group = route_map.add(route_map.g(
+        fill='none', stroke_width='{}px'.format(utils.MAP_LINE_WIDTH),
+    ))
+    for route, contract in _product('contracts').iteritems():
+        if route_paths[route] is None:
             continue
-        utils.add_route_arrow(
-            route_map, from_loc, to_loc,
-            beacons=(contract.beacons if options.beacons else None),
-            stroke=contract.route_color,
-            stroke_width='{}px'.format(utils.MAP_LINE_WIDTH),
-        )
+        routes_group.add(route_map.path(d=route_paths[route], stroke=contract.route_color))
     for loc in LOCATIONS:
         pt = utils.point_on_map(loc.position)
         right_text = (pt[0] < 0.9 * utils.MAP_WIDTH)
@@ -273,7 +541,7 @@ def make_route_map(options):
         if loc.name == 'Ben Bay':
             # I don't know how to fix overlapping of Kerman Lake better.
             text_y_offset = -1.25
-        displace = geometry.Vector(4 if right_text else -4, text_y_offset)
+        displace = geometry.Vec2(4 if right_text else -4, text_y_offset)
         route_map.add(route_map.circle(center=pt, r=utils.MAP_POINT_RADIUS))
         route_map.add(route_map.text(
             loc.name,
@@ -282,10 +550,13 @@ def make_route_map(options):
             font_size='{}px'.format(utils.MAP_FONT_SIZE),
         ))
     if options.beacons:
-        for beacon_name, beacon_pos in BEACONS.iteritems():
+        beacons_group = route_map.add(route_map.g(
+            fill='none', stroke='black', stroke_width='{}px'.format(utils.MAP_CROSS_LINE_WIDTH),
+        ))
+        for beacon_name, beacon_pos in sorted(BEACONS.iteritems()):
             pt = utils.point_on_map(beacon_pos)
-            utils.add_beacon(route_map, pt)
-            if any(geometry.distance(beacon_pos, loc.position) < 25 for loc in LOCATIONS):
+            beacons_group.add(route_map.path(d=utils.beacon_mark_path(pt)))
+            if spatial.locations_index().within(beacon_pos, 25):
                 continue
             right_text = (pt[0] < 0.9 * utils.MAP_WIDTH)
             text_y_offset = 2.25
@@ -295,7 +566,7 @@ def make_route_map(options):
             if beacon_name == 'SCORPION-MOUNTAINS-NDB':
                 # I don't know how to fix overlapping of LONELY-MOUNTAIN-NDB better.
                 right_text = False
-            displace = geometry.Vector(4 if right_text else -4, text_y_offset)
+            displace = geometry.Vec2(4 if right_text else -4, text_y_offset)
             route_map.add(route_map.text(
                 beacon_name,
                 insert=(pt + displace * utils.MAP_POINT_RADIUS),
@@ -305,110 +576,150 @@ def make_route_map(options):
     route_map.save()
 
 
+def _contract_name(contract):
+    return ''.join([
+        contract.from_loc.alphanum_name,
+        contract.to_loc.alphanum_name,
+        contract.__class__.__name__,
+    ])
+
+
+def _make_contract_config(route):
+    """Returns the name of the contract of the route and its config text."""
+    contract = _route_contract(route)
+    contract_config = []
+
+    # Add common contract info.
+    contract_group = 'KerbinSideGap' + contract.__class__.__name__
+    contract_name = _contract_name(contract)
+    contract_config.extend([
+        ('name', contract_name),
+        ('group', contract_group),
+        ('maxSimultaneous', 1),
+        ('targetBody', 'Kerbin'),
+        ('prestige', 'Trivial'),
+        ('deadline', 3),
+    ])
+    if hasattr(contract, 'agent'):
+        contract_config.append(('agent', contract.agent))
+
+    # Add contract texts.
+    flight_title = 'Flight: {} -> {}'.format(contract.from_loc.name, contract.to_loc.name)
+    flight_description = contract.get_description()
+    flight_generic_description = utils.normalize_flight_description(flight_description)
+    flight_synopsis = 'Perform {} flight from the {} to the {}.'.format(
+        contract.get_flight_type(), contract.from_loc.name, contract.to_loc.name,
+    )
+    contract_config.extend([
+        ('title', flight_title),
+        ('description', flight_description),
+    ])
+    if flight_generic_description != flight_description:
+        contract_config.append(('genericDescription', flight_generic_description))
+    contract_config.extend([
+        ('synopsis', ' '.join([flight_synopsis] + contract.get_synopsis_notes())),
+        ('completedMessage', 'Your flight successfully completed.'),
+    ])
+
+    # Add contract reward info.
+    advance_funds, reward_funds, reward_reputation, failure_reputation = contract.get_rewards()
+    contract_config.extend([
+        ('advanceFunds', advance_funds),
+        ('failureReputation', failure_reputation),
+        ('failureFunds', '{} * Random(0.1, 0.25)'.format(advance_funds)),
+        ('rewardReputation', reward_reputation),
+        ('rewardFunds', '({} + {}) * Random(1.0, 1.15)'.format(
+            reward_funds, contract.refund_amount,
+        )),
+        ('rewardScience', 0),
+    ])
+
+    # Add data nodes.
+    contract_config.extend(
+        ('DATA', [('type', type), ('hidden', 'true'), (name, definition)])
+        for type, name, definition in contract.get_data()
+    )
+
+    # Add requirements.
+    contract_config.extend(contract.get_requirements())
+
+    # Add behaviours.
+    waypoints_config = []
+    for wp in contract.get_waypoints():
+        attribute_keys = set(el[0] for el in wp)
+        point_type = 'RANDOM_WAYPOINT'
+        if 'nearIndex' in attribute_keys:
+            point_type = 'RANDOM_WAYPOINT_NEAR'
+        elif 'latitude' in attribute_keys and 'longitude' in attribute_keys:
+            point_type = 'WAYPOINT'
+        waypoints_config.append((point_type, wp))
+    contract_config.append(('BEHAVIOUR', [
+            ('name', 'WaypointGenerator'),
+            ('type', 'WaypointGenerator'),
+        ] + waypoints_config
+    ))
+    contract_config.extend(('BEHAVIOUR', beh) for beh in contract.get_additional_behaviours())
+
+    # Add parameters.
+    contract_config.extend(contract.get_parameters())
+
+    return contract_name, utils.config_to_bytes([('CONTRACT_TYPE', contract_config)])
+
+
 def make_routes(options):
-    """Makes contract files."""
+    """
+    Makes contract files. In incremental mode only files whose inputs have
+    changed since the previous run (according to the manifest) are rewritten.
+    """
     print 'Contract files is generating'
     locations_info = {
         loc.name: {'location': loc, 'incoming': 0, 'outgoing': 0}
         for loc in LOCATIONS
     }
     classes_set = set()
-    for route, contract in ROUTES.iteritems():
-        # Find and count locations.
-        from_loc = locations_info[route[0]]
-        to_loc = locations_info[route[1]]
-        from_loc['outgoing'] += 1
-        to_loc['incoming'] += 1
-
-        # Initialize route and config.
-        contract.set_locations(from_loc['location'], to_loc['location'])
+    manifest = _load_manifest()
+    files = {}
+    fingerprints = {}
+    stale_routes = []
+    for route, contract in _product('contracts').iteritems():
+        # Count locations and classes.
+        locations_info[route[0]]['outgoing'] += 1
+        locations_info[route[1]]['incoming'] += 1
         classes_set.add(contract.__class__)
-        contract_config = []
-
-        # Add common contract info.
-        contract_group = 'KerbinSideGap' + contract.__class__.__name__
-        contract_name = ''.join([
-            contract.from_loc.alphanum_name,
-            contract.to_loc.alphanum_name,
-            contract.__class__.__name__,
-        ])
-        contract_config.extend([
-            ('name', contract_name),
-            ('group', contract_group),
-            ('maxSimultaneous', 1),
-            ('targetBody', 'Kerbin'),
-            ('prestige', 'Trivial'),
-            ('deadline', 3),
-        ])
-        if hasattr(contract, 'agent'):
-            contract_config.append(('agent', contract.agent))
-
-        # Add contract texts.
-        flight_title = 'Flight: {} -> {}'.format(contract.from_loc.name, contract.to_loc.name)
-        flight_description = contract.get_description()
-        flight_generic_description = utils.normalize_flight_description(flight_description)
-        flight_synopsis = 'Perform {} flight from the {} to the {}.'.format(
-            contract.get_flight_type(), contract.from_loc.name, contract.to_loc.name,
-        )
-        contract_config.extend([
-            ('title', flight_title),
-            ('description', flight_description),
-        ])
-        if flight_generic_description != flight_description:
-            contract_config.append(('genericDescription', flight_generic_description))
-        contract_config.extend([
-            ('synopsis', ' '.join([flight_synopsis] + contract.get_synopsis_notes())),
-            ('completedMessage', 'Your flight successfully completed.'),
-        ])
-
-        # Add contract reward info.
-        advance_funds, reward_funds, reward_reputation, failure_reputation = contract.get_rewards()
-        contract_config.extend([
-            ('advanceFunds', advance_funds),
-            ('failureReputation', failure_reputation),
-            ('failureFunds', '{} * Random(0.1, 0.25)'.format(advance_funds)),
-            ('rewardReputation', reward_reputation),
-            ('rewardFunds', '({} + {}) * Random(1.0, 1.15)'.format(
-                reward_funds, contract.refund_amount,
-            )),
-            ('rewardScience', 0),
-        ])
-
-        # Add data nodes.
-        contract_config.extend(
-            ('DATA', [('type', type), ('hidden', 'true'), (name, definition)])
-            for type, name, definition in contract.get_data()
-        )
 
-        # Add requirements.
-        contract_config.extend(contract.get_requirements())
-
-        # Add behaviours.
-        waypoints_config = []
-        for wp in contract.get_waypoints():
-            attribute_keys = set(el[0] for el in wp)
-            point_type = 'RANDOM_WAYPOINT'
-            if 'nearIndex' in attribute_keys:
-                point_type = 'RANDOM_WAYPOINT_NEAR'
-            elif 'latitude' in attribute_keys and 'longitude' in attribute_keys:
-                point_type = 'WAYPOINT'
-            waypoints_config.append((point_type, wp))
-        contract_config.append(('BEHAVIOUR', [
-                ('name', 'WaypointGenerator'),
-                ('type', 'WaypointGenerator'),
-            ] + waypoints_config
-        ))
-        contract_config.extend(('BEHAVIOUR', beh) for beh in contract.get_additional_behaviours())
-
-        # Add parameters.
-        contract_config.extend(contract.get_parameters())
-
-        # Write config.
+        # Check whether the file is up to date.
+        file_name = _contract_name(contract) + '.cfg'
+        fingerprints[route] = fingerprint = _contract_fingerprint(contract)
+        entry = manifest.get(file_name)
+        if (
+            options.incremental and entry is not None and entry['input'] == fingerprint
+            and _file_hash(file_name) == entry['output']
+        ):
+            files[file_name] = entry
+        else:
+            stale_routes.append(route)
+
+    for route, (contract_name, contract_text) in _map_routes(options, _make_contract_config, stale_routes):
         if options.verbose > 1:
             print 'Writing file {}.cfg'.format(contract_name)
+        contract_text = CFG_FILE_HEADER + contract_text
         with open(contract_name + '.cfg', 'w') as out:
-            out.write(CFG_FILE_HEADER)
-            utils.write_config(out, [('CONTRACT_TYPE', contract_config)])
+            out.write(contract_text)
+        files[contract_name + '.cfg'] = {
+            'input': fingerprints[route],
+            'output': hashlib.sha1(contract_text).hexdigest(),
+        }
+
+    for file_name in sorted(set(manifest) - set(files)):
+        if os.path.exists(file_name):
+            if options.verbose > 1:
+                print 'Removing file {}'.format(file_name)
+            os.remove(file_name)
+    _save_manifest(files)
+    if options.verbose > 0 and options.incremental:
+        print 'Contract files: {} rewritten, {} unchanged'.format(
+            len(stale_routes), len(files) - len(stale_routes),
+        )
 
     groups_config = [
         ('minVersion', '1.21.0'),
@@ -426,27 +737,104 @@ def make_routes(options):
             ('maxSimultaneous', contract_class.max_simultaneous),
         ]
         groups_config.append(('CONTRACT_GROUP', group_config))
-    if options.verbose > 1:
-        print 'Writing file Groups.cfg'
-    with open('Groups.cfg', 'w') as out:
-        out.write(CFG_FILE_HEADER)
-        utils.write_config(out, [('CONTRACT_GROUP', groups_config)])
+    groups_text = CFG_FILE_HEADER + utils.config_to_bytes([('CONTRACT_GROUP', groups_config)])
+    if not options.incremental or _file_hash('Groups.cfg') != hashlib.sha1(groups_text).hexdigest():
+        if options.verbose > 1:
+            print 'Writing file Groups.cfg'
+        with open('Groups.cfg', 'w') as out:
+            out.write(groups_text)
 
     if options.verbose > 0:
-        for loc, info in locations_info.iteritems():
+        for loc, info in sorted(locations_info.iteritems()):
             print 'Location "{}": {} incoming, {} outgoing'.format(
                 loc, info['incoming'], info['outgoing']
             )
 
 
+# Stages in the order of output: (option name, function, needed products).
+# Stages selecting runways for routes use ends cached by locations (see
+# REGISTRY.warm), the runways product is for stages listing all of them.
+STAGES = [
+    ('dist', make_distance_table, ()),
+    ('waypoints', make_locations_waypoints, ()),
+    ('runways', make_locations_runways, ('runways',)),
+    ('landing_patterns', make_landing_patterns, ('runways',)),
+    ('rewards', make_reward_table, ('contracts',)),
+    ('flight_plans', make_flight_plans, ('contracts',)),
+    ('plan_beacons', make_beacon_plans, ('contracts',)),
+    ('map', make_route_map, ('contracts', 'route_paths')),
+    ('routes', make_routes, ('contracts',)),
+]
+
+
+def _start(options):
+    """Validates the catalog, warms its caches and makes seeded random choices."""
+    if validation.validate_catalog(force=options.validate) and options.verbose > 0:
+        print 'Catalog is validated'
+    _pin_catalog_points()
+    if options.seed is not None:
+        for route, contract in ROUTES.iteritems():
+            contract.randomize(_route_random(options.seed, route))
+
+
+def _run_stage(args):
+    """Runs the stage in a pool worker, returns everything it has printed."""
+    index, options = args
+    stage_options = argparse.Namespace(**vars(options))
+    stage_options.jobs = 1
+    stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+    try:
+        STAGES[index][1](stage_options)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def run_stages(options, profiler=None):
+    """
+    Runs startup work and all selected stages. Products needed by stages are
+    made once in this process beforehand, then independent stages run in
+    parallel processes if several jobs are allowed. Output of stages is
+    printed in their order. With profiler startup, all products and stages
+    are measured one by one.
+    """
+    def run(name, func, *args):
+        if profiler is None:
+            return func(*args)
+        return profiler.run(name, func, *args)
+
+    run('startup', _start, options)
+    selected = [index for index, (name, _, _) in enumerate(STAGES) if getattr(options, name)]
+    for index in selected:
+        for product_name in STAGES[index][2]:
+            if product_name not in _PRODUCTS:
+                run('product-' + product_name, _product, product_name, options)
+
+    if options.jobs <= 1 or len(selected) < 2 or profiler is not None:
+        for index in selected:
+            run(STAGES[index][0], STAGES[index][1], options)
+        return
+    pool = multiprocessing.Pool(min(options.jobs, len(selected)))
+    try:
+        for output in pool.imap(_run_stage, [(index, options) for index in selected]):
+            sys.stdout.write(output)
+    finally:
+        pool.close()
+        pool.join()
+
+
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('-v', '--verbose', action='count',
         help='Be more verbose. Repeate to increase.')
     parser.add_argument('-d', '--dir', type=str,
         help='Generate files in directory DIR.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+        help='Run stages and process routes in N parallel processes (needs fork(), not on Windows).')
     parser.add_argument('--dist', action='store_true',
         help='Make distances table for locations.')
+    parser.add_argument('--dist-npy', type=str, metavar='FILE',
+        help='Also save distances matrix to .npy FILE (with --dist).')
     parser.add_argument('--waypoints', action='store_true',
         help='Make waypoints file.')
     parser.add_argument('--runways', action='store_true',
@@ -455,36 +843,61 @@ def main():
         help='Make landing patterns.')
     parser.add_argument('--rewards', action='store_true',
         help='Make rewards table for contracts.')
+    parser.add_argument('--reward-samples', type=int, metavar='N',
+        help='Also make rewards distribution by N random samples per contract.')
     parser.add_argument('--flight-plans', action='store_true',
         help='Make flight plans for contracts.')
+    parser.add_argument('--plan-beacons', action='store_true',
+        help='Propose beacons for flight plans of all plane routes.')
     parser.add_argument('--map', action='store_true',
         help='Make routes map.')
     parser.add_argument('--beacons', action='store_true',
         help='Make routes map with only plane routes, considering beacons.')
     parser.add_argument('--routes', action='store_true',
         help='Make routes files themselves.')
+    parser.add_argument('--incremental', action='store_true',
+        help=(
+            'Rewrite only route files whose inputs have changed since the previous run. Random choices '
+            'of contracts are seeded by {} unless --seed is given, so unchanged routes keep their files.'
+        ).format(INCREMENTAL_SEED))
+    parser.add_argument('--profile', nargs='?', const='profile.json', metavar='REPORT',
+        help='Measure every stage and write JSON report to REPORT (profile.json in the current directory by default).')
+    parser.add_argument('--profile-stats', type=str, metavar='DIR',
+        help='Also dump cProfile stats of every stage to DIR (with --profile).')
+    parser.add_argument('--seed', type=int,
+        help='Make random choices of contracts by SEED to get the same files on every run.')
+    parser.add_argument('--validate', action='store_true',
+        help='Validate the catalog even if it is validated already with the same sources.')
     options = parser.parse_args()
-
+    if options.jobs > 1 and not hasattr(os, 'fork'):
+        # Spawned workers would rebuild products and make other random choices.
+        parser.error('parallel jobs need fork() which is not available on this platform, use -j 1')
+    if options.incremental and options.seed is None:
+        options.seed = INCREMENTAL_SEED
+
+    # Paths of extra outputs are relative to the directory the tool is run in.
+    for name in ('dist_npy', 'profile', 'profile_stats'):
+        if getattr(options, name) is not None:
+            setattr(options, name, os.path.abspath(getattr(options, name)))
     if options.dir is not None:
         os.chdir(options.dir)
 
     print 'Found {} locations, {} routes'.format(len(LOCATIONS), len(ROUTES))
-    if options.dist:
-        make_distance_table(options)
-    if options.waypoints:
-        make_locations_waypoints(options)
-    if options.runways:
-        make_locations_runways(options)
-    if options.landing_patterns:
-        make_landing_patterns(options)
-    if options.rewards:
-        make_reward_table(options)
-    if options.flight_plans:
-        make_flight_plans(options)
-    if options.map or options.beacons:
-        make_route_map(options)
-    if options.routes:
-        make_routes(options)
+    options.map = options.map or options.beacons
+    if options.profile is None:
+        run_stages(options)
+        return
+
+    # Calls in pool workers can not be counted, so profiling is serial.
+    options.jobs = 1
+    profiler = profiling.Profiler(options.profile_stats)
+    profiler.install()
+    try:
+        run_stages(options, profiler)
+    finally:
+        profiler.uninstall()
+    profiler.save(options.profile)
+    print 'Profile report is written to {}'.format(options.profile)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+"""Measures speed and accuracy of the geometry functions."""
+
+import sys
+import json
+import time
+import random
+import argparse
+from math import asin, pi
+from decimal import Decimal, getcontext
+
+import geometry
+from beacons import BEACONS
+
+getcontext().prec = 40
+D_PI = Decimal('3.141592653589793238462643383279502884197169399')
+D_RADIUS = Decimal(repr(geometry.KERBIN_RADIUS))
+
+# Points which are known to be hard: poles and the antimeridian.
+SPECIAL_PAIRS = [
+    (BEACONS['ARAKEBO-NDB'], BEACONS['GREEN-COAST-NDB']),
+    (BEACONS['ARAKEBO-NDB'], BEACONS['MISTY-CLIFFS-NDB']),
+    (BEACONS['NORTH-POLE-NDB'], BEACONS['SOUTH-POLE-NDB']),
+    (BEACONS['ZEBEDEE-NDB'], BEACONS['NORTH-POLE-NDB']),
+    (BEACONS['SOUTH-POLE-NDB'], BEACONS['KERBINS-BOTTOM-NDB']),
+    ((89.9999, 0.0), (80.0, 180.0)),
+    ((-89.9999, 45.0), (-70.0, -135.0)),
+    ((0.0, 179.9999), (0.0, -179.9999)),
+    ((10.0, -179.95), (-10.0, 179.95)),
+]
+
+
+# ===== High-precision reference ===== #
+
+def d_sin(x):
+    x = x % (2 * D_PI)
+    result, term, num = Decimal(0), x, 1
+    while abs(term) > Decimal('1e-45'):
+        result += term
+        term = -term * x * x / ((num + 1) * (num + 2))
+        num += 2
+    return result
+
+
+def d_cos(x):
+    return d_sin(x + D_PI / 2)
+
+
+def d_atan(x):
+    if x < 0:
+        return -d_atan(-x)
+    if x > 1:
+        return D_PI / 2 - d_atan(1 / x)
+    if x > Decimal('0.25'):
+        return 2 * d_atan(x / (1 + (1 + x * x).sqrt()))
+    result, term, num = Decimal(0), x, 1
+    while abs(term) > Decimal('1e-45'):
+        result += term / num
+        term = -term * x * x
+        num += 2
+    return result
+
+
+def d_atan2(y, x):
+    if x > 0:
+        return d_atan(y / x)
+    if x < 0:
+        return d_atan(y / x) + (D_PI if y >= 0 else -D_PI)
+    if y == 0:
+        return Decimal(0)
+    return D_PI / 2 if y > 0 else -D_PI / 2
+
+
+def d_rad(deg):
+    return Decimal(repr(float(deg))) * D_PI / 180
+
+
+def d_deg(rad):
+    return rad * 180 / D_PI
+
+
+def d_vector(pt):
+    lat, lon = d_rad(pt[0]), d_rad(pt[1])
+    return (d_cos(lon) * d_cos(lat), d_sin(lon) * d_cos(lat), d_sin(lat))
+
+
+def d_dot(fst, sec):
+    return sum(a * b for a, b in zip(fst, sec))
+
+
+def d_cross(fst, sec):
+    return (
+        fst[1] * sec[2] - sec[1] * fst[2],
+        fst[2] * sec[0] - sec[2] * fst[0],
+        fst[0] * sec[1] - sec[0] * fst[1],
+    )
+
+
+def d_angle(fst, sec):
+    """Returns the angle between vectors (radians)."""
+    return d_atan2(d_dot(d_cross(fst, sec), d_cross(fst, sec)).sqrt(), d_dot(fst, sec))
+
+
+def d_basis(pt):
+    """Returns the north and east unit vectors at the point."""
+    lat, lon = d_rad(pt[0]), d_rad(pt[1])
+    north = (-d_sin(lat) * d_cos(lon), -d_sin(lat) * d_sin(lon), d_cos(lat))
+    east = (-d_sin(lon), d_cos(lon), Decimal(0))
+    return north, east
+
+
+def d_heading(pt1, pt2):
+    north, east = d_basis(pt1)
+    vec2 = d_vector(pt2)
+    return d_atan2(d_dot(vec2, east), d_dot(vec2, north))
+
+
+def d_step_to(pt1, pt2, dist):
+    hdg = d_heading(pt1, pt2)
+    north, east = d_basis(pt1)
+    angle = Decimal(repr(float(dist))) / D_RADIUS
+    direction = [n * d_cos(hdg) + e * d_sin(hdg) for n, e in zip(north, east)]
+    return tuple(v * d_cos(angle) + t * d_sin(angle) for v, t in zip(d_vector(pt1), direction))
+
+
+def point_error(pt, reference):
+    """Returns angle between the point and the reference vector (degrees)."""
+    return float(d_deg(d_angle(d_vector(pt), reference)))
+
+
+def heading_error(hdg, reference):
+    diff = abs(float(hdg) - float(d_deg(reference))) % 360
+    return min(diff, 360 - diff)
+
+
+# ===== Cases ===== #
+
+def check_distance(pt1, pt2):
+    reference = d_angle(d_vector(pt1), d_vector(pt2)) * D_RADIUS
+    return float(d_deg(abs(Decimal(repr(float(geometry.distance(pt1, pt2)))) - reference) / D_RADIUS))
+
+
+def check_heading(pt1, pt2):
+    return heading_error(geometry.heading(pt1, pt2), d_heading(pt1, pt2))
+
+
+def check_step_to(pt1, pt2, dist):
+    return point_error(geometry.step_to(pt1, pt2, dist), d_step_to(pt1, pt2, dist))
+
+
+def check_angles_from_sphere(vector):
+    return point_error(geometry.angles_from_sphere(vector), [Decimal(repr(coord)) for coord in vector])
+
+
+def check_make_route_points(pt1, pt2):
+    points = list(geometry.make_route_points(pt1, pt2))
+    total = d_angle(d_vector(pt1), d_vector(pt2)) * D_RADIUS
+    steps = len(points) - 1
+    return max(
+        point_error(pt, d_step_to(pt1, pt2, total * num / steps))
+        for num, pt in enumerate(points)
+    )
+
+
+def make_cases(count, seed):
+    """Returns fixed random cases for every function (special ones first)."""
+    rnd = random.Random(seed)
+
+    def random_point():
+        return (geometry.rad_to_deg(asin(rnd.uniform(-1, 1))), rnd.uniform(-180, 180))
+
+    pairs = [(pt1[:2], pt2[:2]) for pt1, pt2 in SPECIAL_PAIRS]
+    while len(pairs) < count:
+        pt1, pt2 = random_point(), random_point()
+        if 1 < geometry.distance(pt1, pt2) < 0.99 * geometry.KERBIN_RADIUS * pi:
+            pairs.append((pt1, pt2))
+    steps = [
+        (pt1, pt2, rnd.uniform(-0.95, 0.95) * (geometry.KERBIN_RADIUS * pi / 2 - geometry.MAX_ROUTE_STEP))
+        for pt1, pt2 in pairs
+    ]
+    route_pairs = [
+        (pt1, pt2) for pt1, pt2 in pairs
+        if geometry.distance(pt1, pt2) < 0.5 * geometry.KERBIN_RADIUS * pi
+    ][:max(1, count // 20)]
+    return {
+        'distance': (geometry.distance, check_distance, pairs),
+        'heading': (geometry.heading, check_heading, pairs),
+        'step_to': (geometry.step_to, check_step_to, steps),
+        'angles_from_sphere': (
+            geometry.angles_from_sphere, check_angles_from_sphere,
+            [(tuple(geometry.point_on_sphere(pt1)),) for pt1, _ in pairs],
+        ),
+        'make_route_points': (
+            (lambda pt1, pt2: list(geometry.make_route_points(pt1, pt2))),
+            check_make_route_points, route_pairs,
+        ),
+    }
+
+
+def measure_speed(func, args_list, repeat):
+    """Returns the best number of calls per second."""
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        for args in args_list:
+            func(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(args_list) / max(best, 1e-9)
+
+
+def compare(report, previous):
+    """Prints changes of speed and accuracy relative to the previous report."""
+    print '{:<20} {:>14} {:>10} {:>14} {:>14}'.format(
+        'Function', 'ops/sec', 'speedup', 'max error', 'was',
+    )
+    for name in sorted(report['results']):
+        result = report['results'][name]
+        old = previous['results'].get(name)
+        print '{:<20} {:>14.1f} {:>10} {:>14.3g} {:>14}'.format(
+            name, result['ops_per_sec'],
+            'x{:.2f}'.format(result['ops_per_sec'] / old['ops_per_sec']) if old else '-',
+            result['max_error_deg'],
+            '{:.3g}'.format(old['max_error_deg']) if old else '-',
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-o', '--output', type=str, default='geometry-benchmark.json',
+        help='Write JSON report to OUTPUT.')
+    parser.add_argument('-c', '--compare', type=str,
+        help='Compare results with the previous JSON report.')
+    parser.add_argument('-n', '--points', type=int, default=1000,
+        help='Number of point pairs to measure speed on.')
+    parser.add_argument('-a', '--accuracy-points', type=int, default=200,
+        help='Number of point pairs to check accuracy on (reference is slow).')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help='Number of speed measurements to take the best one.')
+    parser.add_argument('--seed', type=int, default=1,
+        help='Seed for random point sets.')
+    options = parser.parse_args()
+
+    report = {
+        'kernel': geometry.GEOMETRY_KERNEL,
+        'numpy': geometry.get_numpy() is not None,
+        'points': options.points,
+        'seed': options.seed,
+        'results': {},
+    }
+    for name, (func, check, args_list) in sorted(make_cases(options.points, options.seed).iteritems()):
+        print >> sys.stderr, 'Measuring {}'.format(name)
+        accuracy_cases = args_list[:max(len(SPECIAL_PAIRS), options.accuracy_points * len(args_list) // options.points)]
+        report['results'][name] = {
+            'ops_per_sec': measure_speed(func, args_list, options.repeat),
+            'max_error_deg': max(check(*args) for args in accuracy_cases),
+        }
+
+    with open(options.output, 'w') as out:
+        json.dump(report, out, indent=2, sort_keys=True)
+    previous = {'results': {}}
+    if options.compare is not None:
+        with open(options.compare) as file:
+            previous = json.load(file)
+    compare(report, previous)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,16 @@
-from math import sqrt, sin, cos, tan, asin, acos, pi
+import os
+from math import sqrt, hypot, sin, cos, tan, asin, acos, atan2, pi
 
 KERBIN_RADIUS = 600.0
 MAX_ROUTE_STEP = 25.0
 
+# Scalar functions implementation: 'closed-form' (haversine, atan2 and direct
+# destination formulas) or 'vector' (operations on vectors in 3D space).
+GEOMETRY_KERNEL = os.environ.get('KSGAP_GEOMETRY_KERNEL', 'closed-form')
+
+# Maximum number of cached unit vectors for points which are not pinned.
+UNIT_VECTOR_CACHE_SIZE = 4096
+
 
 class Vector(object):
     DIMENSION_ERROR = 'Can not combine Vectors with different dimensions'
@@ -73,6 +81,144 @@ class Vector(object):
         return ','.join(str(round(coord, 2)) for coord in self.data)
 
 
+class Vec2(object):
+    """
+    Fixed-size 2D vector with the same interface as Vector, but much cheaper
+    arithmetic. Use it in hot loops.
+    """
+    __slots__ = ('x', 'y')
+
+    @staticmethod
+    def cross(fst, sec):
+        return fst.x * sec.y - sec.x * fst.y
+
+    @classmethod
+    def normalize(cls, obj):
+        normalizator = 1.0 / abs(obj)
+        return cls(obj.x * normalizator, obj.y * normalizator)
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        return iter((self.x, self.y))
+
+    def __getitem__(self, key):
+        return (self.x, self.y)[key]
+
+    def __eq__(self, other):
+        return self.x == other.x and self.y == other.y
+
+    def __add__(self, other):
+        return Vec2(self.x + other.x, self.y + other.y)
+
+    def __sub__(self, other):
+        return Vec2(self.x - other.x, self.y - other.y)
+
+    def __mul__(self, other):
+        if isinstance(other, Vec2):
+            return self.x * other.x + self.y * other.y
+        return Vec2(self.x * other, self.y * other)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Vec2(-self.x, -self.y)
+
+    def __abs__(self):
+        return hypot(self.x, self.y)
+
+    def __repr__(self):
+        return 'Vec2({!r}, {!r})'.format(self.x, self.y)
+
+    def svg_form(self):
+        return str(round(self.x, 2)) + ',' + str(round(self.y, 2))
+
+
+class Vec3(object):
+    """
+    Fixed-size 3D vector with the same interface as Vector, but much cheaper
+    arithmetic. Use it in hot loops.
+    """
+    __slots__ = ('x', 'y', 'z')
+
+    @staticmethod
+    def cross(fst, sec):
+        return Vec3(
+            fst.y * sec.z - sec.y * fst.z,
+            fst.z * sec.x - sec.z * fst.x,
+            fst.x * sec.y - sec.x * fst.y,
+        )
+
+    @classmethod
+    def normalize(cls, obj):
+        normalizator = 1.0 / abs(obj)
+        return cls(obj.x * normalizator, obj.y * normalizator, obj.z * normalizator)
+
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.z))
+
+    def __getitem__(self, key):
+        return (self.x, self.y, self.z)[key]
+
+    def __eq__(self, other):
+        return self.x == other.x and self.y == other.y and self.z == other.z
+
+    def __add__(self, other):
+        return Vec3(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return Vec3(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, other):
+        if isinstance(other, Vec3):
+            return self.x * other.x + self.y * other.y + self.z * other.z
+        return Vec3(self.x * other, self.y * other, self.z * other)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Vec3(-self.x, -self.y, -self.z)
+
+    def __abs__(self):
+        return sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    def __repr__(self):
+        return 'Vec3({!r}, {!r}, {!r})'.format(self.x, self.y, self.z)
+
+    def svg_form(self):
+        return ','.join((str(round(self.x, 2)), str(round(self.y, 2)), str(round(self.z, 2))))
+
+
+_NUMPY = []
+
+
+def get_numpy():
+    """
+    Returns NumPy module or None if it is not installed. NumPy is slow to
+    import, so it is imported on the first call rather than at start.
+    """
+    if not _NUMPY:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _NUMPY.append(numpy)
+    return _NUMPY[0]
+
+
 def deg_to_rad(deg):
     return pi * deg / 180
 
@@ -89,10 +235,78 @@ def bound(func, arg):
 def point_on_sphere(pt):
     """Returns point on a sphere given by angle coordinates."""
     theta, phi = map(deg_to_rad, pt[:2])
-    return Vector(cos(phi) * cos(theta), sin(phi) * cos(theta), sin(theta))
+    return Vec3(cos(phi) * cos(theta), sin(phi) * cos(theta), sin(theta))
+
 
+class UnitVectorCache(object):
+    """
+    Cache of points on a sphere keyed by angle coordinates. Named points are
+    pinned: they are never evicted and also stored in the contiguous array
+    for batch functions. Ad-hoc points are dropped all at once when there are
+    too many of them.
+    """
 
-def angles_from_sphere(pt):
+    def __init__(self, max_adhoc=UNIT_VECTOR_CACHE_SIZE):
+        self.max_adhoc = max_adhoc
+        self.pinned = {}
+        self.indices = {}
+        self.adhoc = {}
+        self.array = None
+
+    def pin(self, points):
+        """Caches vectors of the named points permanently."""
+        vectors = []
+        for pt in points:
+            key = (pt[0], pt[1])
+            if key not in self.pinned:
+                self.pinned[key] = vector = point_on_sphere(pt)
+                self.indices[key] = len(self.indices)
+                vectors.append(tuple(vector))
+        numpy = get_numpy()
+        if numpy is not None and vectors:
+            self.array = numpy.array(vectors) if self.array is None else numpy.vstack((self.array, vectors))
+
+    def index(self, pt):
+        """Returns the row of the pinned point in the array (or None)."""
+        return self.indices.get((pt[0], pt[1]))
+
+    def get_array(self, pts):
+        """
+        Returns (N, 3) array of points on a sphere for the list of angle
+        coordinates (NumPy is required). Pinned points are taken from the
+        array, the rest are calculated at once.
+        """
+        numpy = get_numpy()
+        rows = [self.indices.get((pt[0], pt[1])) for pt in pts]
+        if None not in rows:
+            return self.array[rows] if rows else numpy.empty((0, 3))
+        missing = [num for num, row in enumerate(rows) if row is None]
+        if len(missing) == len(rows):
+            return _points_on_sphere_array(pts)
+        result = numpy.empty((len(rows), 3))
+        found = [num for num, row in enumerate(rows) if row is not None]
+        result[found] = self.array[[rows[num] for num in found]]
+        result[missing] = _points_on_sphere_array([pts[num] for num in missing])
+        return result
+
+    def get(self, pt):
+        """Returns point on a sphere given by angle coordinates."""
+        key = (pt[0], pt[1])
+        vector = self.pinned.get(key)
+        if vector is None:
+            vector = self.adhoc.get(key)
+            if vector is None:
+                if len(self.adhoc) >= self.max_adhoc:
+                    self.adhoc.clear()
+                vector = self.adhoc[key] = point_on_sphere(pt)
+        return vector
+
+
+UNIT_VECTORS = UnitVectorCache()
+unit_vector = UNIT_VECTORS.get
+
+
+def _vector_angles_from_sphere(pt):
     """Returns angle coordinates of the point on a sphere."""
     theta = bound(asin, pt[2])
     phi = bound(acos, pt[0] / cos(theta))
@@ -108,27 +322,27 @@ def chord_to_tangent(pt1, pt2):
     chord = pt2 - pt1
     coef = chord * pt1
     tang_dir = chord - coef * pt1
-    return Vector.normalize(tang_dir)
+    return Vec3.normalize(tang_dir)
 
 
-def step_to(pt1, pt2, dist):
+def _vector_step_to(pt1, pt2, dist):
     """
     Returns point lying on the line along the surface from the first point to
     the second, with specified distance from the first point (in kilometres).
     """
-    pt1 = point_on_sphere(pt1)
-    pt2 = point_on_sphere(pt2)
+    pt1 = unit_vector(pt1)
+    pt2 = unit_vector(pt2)
     if abs(dist) + MAX_ROUTE_STEP > KERBIN_RADIUS * pi / 2:
         raise ValueError(
             'Too big distance {}, can not provide acceptable accuracy'.format(dist)
             + ' (consider dividing step into several parts)'
         )
     tang_distance = tan(dist / KERBIN_RADIUS)
-    pt = Vector.normalize(pt1 + chord_to_tangent(pt1, pt2) * tang_distance)
+    pt = Vec3.normalize(pt1 + chord_to_tangent(pt1, pt2) * tang_distance)
     return angles_from_sphere(pt)
 
 
-def distance(pt1, pt2):
+def _vector_distance(pt1, pt2):
     """Calculates distance between points along the surface."""
     pt1 = map(deg_to_rad, pt1[:2])
     pt2 = map(deg_to_rad, pt2[:2])
@@ -136,36 +350,259 @@ def distance(pt1, pt2):
     return KERBIN_RADIUS * bound(acos, ang_cos)
 
 
+def _route_steps(vec1, vec2):
+    """
+    Returns the angle between points on a sphere and the number of steps
+    needed to go from the first one to the second.
+    """
+    angle = atan2(abs(Vec3.cross(vec1, vec2)), vec1 * vec2)
+    if angle > pi - 1e-9:
+        raise ValueError('Can not make route between antipodal points')
+    return angle, max(1, int(KERBIN_RADIUS * angle / MAX_ROUTE_STEP + 0.95))
+
+
 def make_route_points(pt1, pt2, include_first=True, include_last=True):
     """
     Yields evenly distributed points lying not too far from each other on the
-    line along the surface from the first point to the second.
+    line along the surface from the first point to the second. Every point is
+    interpolated directly between the ends, so errors do not accumulate.
     """
-    dist = distance(pt1, pt2)
-    steps = int(dist / MAX_ROUTE_STEP + 0.95)
-    step = dist / steps
+    vec1 = unit_vector(pt1)
+    vec2 = unit_vector(pt2)
+    angle, steps = _route_steps(vec1, vec2)
 
     if include_first:
         yield pt1
-    for _ in xrange(steps - 1):
-        pt1 = step_to(pt1, pt2, step)
-        yield pt1
+    if steps > 1:
+        normalizator = 1.0 / sin(angle)
+        for step in xrange(1, steps):
+            part = float(step) / steps
+            pt = vec1 * (sin((1 - part) * angle) * normalizator) + vec2 * (sin(part * angle) * normalizator)
+            yield angles_from_sphere(pt)
     if include_last:
         yield pt2
 
 
-def heading(pt1, pt2):
+def _vector_heading(pt1, pt2):
     """
     Returns heading at the first point of the direction from the first point to
     the second.
     """
-    pt1 = point_on_sphere(pt1)
-    pt2 = point_on_sphere(pt2)
+    pt1 = unit_vector(pt1)
+    pt2 = unit_vector(pt2)
     dir_tang = chord_to_tangent(pt1, pt2)
-    north_pole = point_on_sphere((90, 0))
+    north_pole = unit_vector((90, 0))
     pole_tang = chord_to_tangent(pt1, north_pole)
 
     heading = rad_to_deg(bound(acos, dir_tang * pole_tang))
-    if pt1 * Vector.cross(dir_tang, pole_tang) < 0:
+    if pt1 * Vec3.cross(dir_tang, pole_tang) < 0:
         return 360 - heading
     return heading
+
+
+def _closed_form_angles_from_sphere(pt):
+    """Returns angle coordinates of the point on a sphere."""
+    return [rad_to_deg(atan2(pt[2], hypot(pt[0], pt[1]))), rad_to_deg(atan2(pt[1], pt[0]))]
+
+
+def _closed_form_step_to(pt1, pt2, dist):
+    """
+    Returns point lying on the line along the surface from the first point to
+    the second, with specified distance from the first point (in kilometres).
+    The point is the direct rotation of the first one in the plane of the line.
+    """
+    vec1 = unit_vector(pt1)
+    vec2 = unit_vector(pt2)
+    proj = vec1.x * vec2.x + vec1.y * vec2.y + vec1.z * vec2.z
+    tang_x, tang_y, tang_z = vec2.x - proj * vec1.x, vec2.y - proj * vec1.y, vec2.z - proj * vec1.z
+    ang_dist = dist / KERBIN_RADIUS
+    vec_coef = cos(ang_dist)
+    tang_coef = sin(ang_dist) / sqrt(tang_x * tang_x + tang_y * tang_y + tang_z * tang_z)
+    x = vec_coef * vec1.x + tang_coef * tang_x
+    y = vec_coef * vec1.y + tang_coef * tang_y
+    z = vec_coef * vec1.z + tang_coef * tang_z
+    return [rad_to_deg(atan2(z, hypot(x, y))), rad_to_deg(atan2(y, x))]
+
+
+def _closed_form_distance(pt1, pt2):
+    """
+    Calculates distance between points along the surface (haversine, which
+    equals to the half of the chord between points on the unit sphere).
+    """
+    vec1 = unit_vector(pt1)
+    vec2 = unit_vector(pt2)
+    dx, dy, dz = vec1.x - vec2.x, vec1.y - vec2.y, vec1.z - vec2.z
+    return 2 * KERBIN_RADIUS * bound(asin, 0.5 * sqrt(dx * dx + dy * dy + dz * dz))
+
+
+def _closed_form_heading(pt1, pt2):
+    """
+    Returns heading at the first point of the direction from the first point to
+    the second (atan2 of the east and north components of the direction).
+    """
+    vec1 = unit_vector(pt1)
+    vec2 = unit_vector(pt2)
+    hdg = atan2(
+        vec1.x * vec2.y - vec1.y * vec2.x,
+        vec2.z * (vec1.x * vec1.x + vec1.y * vec1.y) - vec1.z * (vec1.x * vec2.x + vec1.y * vec2.y),
+    )
+    return rad_to_deg(hdg) % 360
+
+
+KERNELS = {
+    'closed-form': (
+        _closed_form_angles_from_sphere, _closed_form_step_to,
+        _closed_form_distance, _closed_form_heading,
+    ),
+    'vector': (
+        _vector_angles_from_sphere, _vector_step_to,
+        _vector_distance, _vector_heading,
+    ),
+}
+if GEOMETRY_KERNEL not in KERNELS:
+    raise ImportError('Unknown geometry kernel "{}", choose one of: {}'.format(
+        GEOMETRY_KERNEL, ', '.join(sorted(KERNELS)),
+    ))
+angles_from_sphere, step_to, distance, heading = KERNELS[GEOMETRY_KERNEL]
+
+
+# ===== Batch versions (vectorized if NumPy is available) ===== #
+
+def _angles_array(pts):
+    """Returns (N, 2) array of latitudes and longitudes in radians."""
+    numpy = get_numpy()
+    return numpy.radians(numpy.array([pt[:2] for pt in pts], dtype=float).reshape(-1, 2))
+
+
+def points_on_sphere(pts):
+    """Returns points on a sphere for the list of angle coordinates."""
+    if get_numpy() is None:
+        return [unit_vector(pt) for pt in pts]
+    return UNIT_VECTORS.get_array(pts)
+
+
+def _points_on_sphere_array(pts):
+    numpy = get_numpy()
+    theta, phi = _angles_array(pts).T
+    return numpy.column_stack((
+        numpy.cos(phi) * numpy.cos(theta), numpy.sin(phi) * numpy.cos(theta), numpy.sin(theta),
+    ))
+
+
+def distances(pts1, pts2):
+    """Calculates distances along the surface between pairs of points."""
+    numpy = get_numpy()
+    if numpy is None:
+        return [distance(pt1, pt2) for pt1, pt2 in zip(pts1, pts2)]
+    return _distances(_angles_array(pts1), _angles_array(pts2))
+
+
+def distance_matrix(pts1, pts2):
+    """
+    Calculates distances along the surface from each point of the first list
+    to each point of the second one (result is a list of rows).
+    """
+    numpy = get_numpy()
+    if numpy is None:
+        return [[distance(pt1, pt2) for pt2 in pts2] for pt1 in pts1]
+    return _chord_distances(points_on_sphere(pts1)[:, None], points_on_sphere(pts2)[None, :])
+
+
+def upper_distance_rows(pts):
+    """
+    Yields distances from every point to all the following ones, i.e. rows of
+    the upper triangle of the symmetric distance matrix, one at a time.
+    """
+    numpy = get_numpy()
+    if numpy is None:
+        for index, pt1 in enumerate(pts):
+            yield [distance(pt1, pt2) for pt2 in pts[index + 1:]]
+        return
+    rad = _angles_array(pts)
+    for index in xrange(len(rad)):
+        yield _distances(rad[index], rad[index + 1:])
+
+
+def _distances(rad1, rad2):
+    numpy = get_numpy()
+    lat1, lon1 = rad1[..., 0], rad1[..., 1]
+    lat2, lon2 = rad2[..., 0], rad2[..., 1]
+    hav = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2
+    return 2 * KERBIN_RADIUS * numpy.arcsin(numpy.clip(numpy.sqrt(hav), -1, 1))
+
+
+def _chord_distances(vec1, vec2):
+    """The same as _closed_form_distance, but for arrays of points on a sphere."""
+    numpy = get_numpy()
+    chord = numpy.sqrt(((vec1 - vec2) ** 2).sum(axis=-1))
+    return 2 * KERBIN_RADIUS * numpy.arcsin(numpy.clip(0.5 * chord, -1, 1))
+
+
+def headings(pts1, pts2):
+    """Returns headings at the first points of the directions to the second."""
+    numpy = get_numpy()
+    if numpy is None:
+        return [heading(pt1, pt2) for pt1, pt2 in zip(pts1, pts2)]
+    return numpy.degrees(_headings(_angles_array(pts1), _angles_array(pts2))) % 360
+
+
+def _headings(rad1, rad2):
+    numpy = get_numpy()
+    lat1, lon1 = rad1.T
+    lat2, lon2 = rad2.T
+    return numpy.arctan2(
+        numpy.sin(lon2 - lon1) * numpy.cos(lat2),
+        numpy.cos(lat1) * numpy.sin(lat2) - numpy.sin(lat1) * numpy.cos(lat2) * numpy.cos(lon2 - lon1),
+    )
+
+
+def steps_to(pts1, pts2, dists):
+    """
+    Returns points lying on the lines along the surface from the first points
+    to the second, with specified distances from the first points (in
+    kilometres). Unlike step_to has no limit on the distance.
+    """
+    numpy = get_numpy()
+    if numpy is None:
+        return [step_to(pt1, pt2, dist) for pt1, pt2, dist in zip(pts1, pts2, dists)]
+    rad1 = _angles_array(pts1)
+    hdg = _headings(rad1, _angles_array(pts2))
+    ang_dist = numpy.asarray(dists, dtype=float) / KERBIN_RADIUS
+    lat1, lon1 = rad1.T
+    lat = numpy.arcsin(numpy.clip(
+        numpy.sin(lat1) * numpy.cos(ang_dist) + numpy.cos(lat1) * numpy.sin(ang_dist) * numpy.cos(hdg),
+        -1, 1,
+    ))
+    lon = lon1 + numpy.arctan2(
+        numpy.sin(hdg) * numpy.sin(ang_dist) * numpy.cos(lat1),
+        numpy.cos(ang_dist) - numpy.sin(lat1) * numpy.sin(lat),
+    )
+    lon = (numpy.degrees(lon) + 180) % 360 - 180
+    return numpy.column_stack((numpy.degrees(lat), lon))
+
+
+def route_points_array(pt1, pt2, include_first=True, include_last=True):
+    """
+    Returns the same points as make_route_points, but all at once in the
+    preallocated (N, 2) array of latitudes and longitudes.
+    """
+    numpy = get_numpy()
+    if numpy is None:
+        return [pt[:2] for pt in make_route_points(pt1, pt2, include_first, include_last)]
+    vec1 = unit_vector(pt1)
+    vec2 = unit_vector(pt2)
+    angle, steps = _route_steps(vec1, vec2)
+
+    first = 0 if include_first else 1
+    last = steps if include_last else steps - 1
+    points = numpy.empty((last - first + 1, 2))
+    parts = numpy.arange(first, last + 1, dtype=float) / steps
+    coefs = numpy.column_stack((numpy.sin((1 - parts) * angle), numpy.sin(parts * angle))) / sin(angle)
+    vectors = coefs.dot([tuple(vec1), tuple(vec2)])
+    points[:, 0] = numpy.degrees(numpy.arctan2(vectors[:, 2], numpy.hypot(vectors[:, 0], vectors[:, 1])))
+    points[:, 1] = numpy.degrees(numpy.arctan2(vectors[:, 1], vectors[:, 0]))
+    if include_first:
+        points[0] = pt1[:2]
+    if include_last:
+        points[-1] = pt2[:2]
+    return points
@@ -0,0 +1,116 @@
+"""Automatic selection of beacons for the flight plans."""
+
+import heapq
+
+import geometry
+from beacons import BEACONS
+
+MAX_LEG_DISTANCE = 450.0  # km
+ALTITUDE_PENALTY = 0.02  # km of extra path per metre of altitude change
+
+ORIGIN = '<origin>'
+
+
+class BeaconGraph(object):
+    """
+    Graph of beacons connected by legs not longer than the maximum one. Leg
+    cost is its length plus the penalty for altitude change.
+    """
+
+    def __init__(self, beacons=None, max_leg=MAX_LEG_DISTANCE, altitude_penalty=ALTITUDE_PENALTY):
+        """
+        @param beacons Dictionary of beacons (name -> position), all known
+                       beacons by default.
+        @param max_leg Maximum allowed distance between waypoints (in km).
+        @param altitude_penalty Extra cost of the leg per metre of altitude
+                                change between its ends.
+        """
+        if beacons is None:
+            beacons = BEACONS
+        self.max_leg = max_leg
+        self.altitude_penalty = altitude_penalty
+        self.names = sorted(beacons)
+        self.positions = [beacons[name] for name in self.names]
+        self.legs = {name: [] for name in self.names}
+        matrix = geometry.distance_matrix(self.positions, self.positions)
+        for fst, row in enumerate(matrix):
+            for sec, dist in enumerate(row):
+                if fst != sec and dist <= max_leg:
+                    self.legs[self.names[fst]].append((self.names[sec], float(dist)))
+
+    def _leg_cost(self, dist, pt1, pt2):
+        return dist + self.altitude_penalty * abs(pt1[2] - pt2[2])
+
+    def _end_legs(self, pt):
+        """Returns legs from the given point to all beacons in reach."""
+        return [
+            (name, float(dist))
+            for name, dist in zip(self.names, geometry.distance_matrix([pt], self.positions)[0])
+            if dist <= self.max_leg
+        ]
+
+    def plan(self, start, finish_points):
+        """
+        Finds the cheapest path from the start point to any of finish points
+        (A* search). Points have latitude, longitude and altitude. Returns the
+        list of beacon names to visit or None if there is no path.
+        """
+        position = dict(zip(self.names, self.positions))
+        position[ORIGIN] = start
+        legs = dict(self.legs)
+        legs[ORIGIN] = self._end_legs(start)
+        for finish in finish_points:
+            position[finish] = finish
+            dist = geometry.distance(start, finish)
+            if dist <= self.max_leg:
+                legs[ORIGIN].append((finish, dist))
+            for name, dist in self._end_legs(finish):
+                legs[name] = legs[name] + [(finish, dist)]
+
+        def estimate(pt):
+            return min(geometry.distance(pt, finish) for finish in finish_points)
+
+        best = {ORIGIN: 0.0}
+        previous = {}
+        queue = [(estimate(start), 0.0, ORIGIN)]
+        while queue:
+            _, cost, node = heapq.heappop(queue)
+            if cost > best[node]:
+                continue
+            if node in finish_points:
+                path = []
+                while node != ORIGIN:
+                    node = previous[node]
+                    path.append(node)
+                return [name for name in reversed(path) if name != ORIGIN]
+            for next_node, dist in legs.get(node, []):
+                next_cost = cost + self._leg_cost(dist, position[node], position[next_node])
+                if next_node not in best or next_cost < best[next_node]:
+                    best[next_node] = next_cost
+                    previous[next_node] = node
+                    heapq.heappush(queue, (next_cost + estimate(position[next_node]), next_cost, next_node))
+        return None
+
+
+def landing_points(loc):
+    """Returns all runway ends of location allowed for landing."""
+    return [runway_end.landing_point for runway_end in loc.runway_ends]
+
+
+def plan_route(from_loc, to_loc, graph=None):
+    """
+    Proposes beacons for the flight between locations (both must have runways).
+    """
+    if graph is None:
+        graph = BeaconGraph()
+    return graph.plan(from_loc.runways[0][1], landing_points(to_loc))
+
+
+def plan_routes(routes, graph=None):
+    """
+    Proposes beacons for all given pairs of locations in one pass reusing the
+    same graph. Returns the list of proposals in the same order.
+    """
+    if graph is None:
+        graph = BeaconGraph()
+    return [plan_route(from_loc, to_loc, graph) for from_loc, to_loc in routes]
@@ -0,0 +1,116 @@
+"""Profiling of generator stages: timings, calls of hot functions and output sizes."""
+
+import os
+import json
+import time
+import cProfile
+import functools
+
+import utils
+import geometry
+
+# Functions to count calls of: (module, function name).
+COUNTED_FUNCTIONS = [
+    (geometry, 'step_to'),
+    (geometry, 'distance'),
+    (geometry, 'heading'),
+    (utils, 'write_config'),
+    (utils, 'config_to_bytes'),
+]
+
+
+def _cpu_time():
+    """Returns user and system time of this process and its children."""
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+def _files_state():
+    """Returns (modification time, size) of files in the current directory."""
+    state = {}
+    for name in os.listdir('.'):
+        if os.path.isfile(name):
+            stat = os.stat(name)
+            state[name] = (stat.st_mtime, stat.st_size)
+    return state
+
+
+class Profiler(object):
+    """
+    Records wall and CPU time of every run step, calls of the hot functions
+    during it and sizes of files it has written in the current directory.
+    """
+
+    def __init__(self, stats_dir=None):
+        """
+        @param stats_dir Directory to dump cProfile stats of every step to
+                         (<step name>.prof), no dumps if None.
+        """
+        self.stats_dir = stats_dir
+        self.counts = {
+            '{}.{}'.format(module.__name__, name): 0 for module, name in COUNTED_FUNCTIONS
+        }
+        self.originals = []
+        self.steps = []
+
+    def _counted(self, key, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.counts[key] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    def install(self):
+        """Replaces the hot functions by counting wrappers."""
+        for module, name in COUNTED_FUNCTIONS:
+            func = getattr(module, name)
+            self.originals.append((module, name, func))
+            setattr(module, name, self._counted('{}.{}'.format(module.__name__, name), func))
+
+    def uninstall(self):
+        """Restores the original hot functions."""
+        for module, name, func in reversed(self.originals):
+            setattr(module, name, func)
+        self.originals = []
+
+    def run(self, name, func, *args):
+        """Runs func(*args) as a step with the given name, returns its result."""
+        counts_before = dict(self.counts)
+        files_before = _files_state()
+        profile = cProfile.Profile() if self.stats_dir is not None else None
+        start_wall, start_cpu = time.time(), _cpu_time()
+        result = func(*args) if profile is None else profile.runcall(func, *args)
+        wall_time, cpu_time = time.time() - start_wall, _cpu_time() - start_cpu
+
+        written = {
+            file_name: size
+            for file_name, (mtime, size) in _files_state().iteritems()
+            if files_before.get(file_name, (None, None))[0] != mtime
+        }
+        if profile is not None:
+            if not os.path.isdir(self.stats_dir):
+                os.makedirs(self.stats_dir)
+            profile.dump_stats(os.path.join(self.stats_dir, '{}.prof'.format(name)))
+        self.steps.append({
+            'name': name,
+            'wall_time': wall_time,
+            'cpu_time': cpu_time,
+            'calls': {key: count - counts_before[key] for key, count in self.counts.iteritems()},
+            'files': written,
+            'bytes_written': sum(written.itervalues()),
+        })
+        return result
+
+    def report(self):
+        return {
+            'geometry_kernel': geometry.GEOMETRY_KERNEL,
+            'numpy': geometry.get_numpy() is not None,
+            'steps': self.steps,
+            'total_wall_time': sum(step['wall_time'] for step in self.steps),
+            'total_cpu_time': sum(step['cpu_time'] for step in self.steps),
+        }
+
+    def save(self, path):
+        """Writes JSON report to the file."""
+        with open(path, 'w') as out:
+            json.dump(self.report(), out, indent=2, sort_keys=True)
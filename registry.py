@@ -0,0 +1,95 @@
+"""Registry of all locations indexed for fast lookups and route validation."""
+
+from itertools import chain
+
+import spatial
+import geometry
+from catalog import LOCATIONS
+
+POINT_TYPES = ('helipad', 'aircraft_launch', 'aircraft_parking', 'staff_spawn', 'vip_spawn')
+
+
+class LocationRegistry(object):
+    """
+    Locations indexed by name, KerbalKonstructs base name and alphanumeric
+    name. Spatial queries are served by the k-d tree of the spatial module.
+    """
+
+    def __init__(self, locations):
+        """
+        @param locations List of locations, it may be changed in place later
+                         and indexed again by reindex().
+        """
+        self.locations = locations
+        self.reindex()
+
+    def reindex(self):
+        """Builds all indices of the locations, names must be unique."""
+        self.by_name = {}
+        self.by_kk_base_name = {}
+        self.by_alphanum_name = {}
+        for loc in self.locations:
+            for index, key in [
+                (self.by_name, loc.name),
+                (self.by_kk_base_name, loc.kk_base_name),
+                (self.by_alphanum_name, loc.alphanum_name),
+            ]:
+                if key in index:
+                    raise ValueError('Locations {} and {} have the same name "{}"'.format(index[key], loc, key))
+                index[key] = loc
+        spatial.reset_indices('locations')
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def __len__(self):
+        return len(self.locations)
+
+    @property
+    def spatial(self):
+        """Spatial index of the locations (keys are Location objects)."""
+        return spatial.locations_index()
+
+    def nearest(self, pt, count=1):
+        """Returns up to count nearest locations as (distance, location) pairs."""
+        return self.spatial.nearest(pt, count)
+
+    def within(self, pt, radius):
+        """Returns locations not further than radius as (distance, location) pairs."""
+        return self.spatial.within(pt, radius)
+
+    def route_errors(self, routes):
+        """Returns sorted list of unknown locations the routes refer to."""
+        return sorted(set(
+            'unknown location "{}" in route {} -> {}'.format(name, *route)
+            for route in routes
+            for name in route
+            if name not in self.by_name
+        ))
+
+    def warm(self):
+        """
+        Caches unit vectors of all named points and runway ends of locations
+        and builds the spatial index, so workers forked later share them.
+        """
+        points = []
+        for loc in self.locations:
+            points.extend(
+                getattr(loc, point_type)
+                for point_type in POINT_TYPES
+                if getattr(loc, point_type) is not None
+            )
+            points.extend(chain.from_iterable(loc.runways or []))
+        geometry.UNIT_VECTORS.pin(points)
+        for loc in self.locations:
+            _ = loc.runway_ends  # computed and cached by the location
+        spatial.locations_index()
+
+
+REGISTRY = LocationRegistry(LOCATIONS)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Runway ends of locations with their derived parameters, computed once."""
+
+import re
+from math import tan
+
+import geometry
+
+METERS_PER_KILOMETER = 1000
+
+MIN_GLIDESLOPE_ANGLE = 3.3
+IAF_DISTANCE = 25.0
+FAF_DISTANCE = 10.0
+FLARE_DISTANCE = 0.2
+
+GLIDESLOPE_ALTITUDE_CORRECTION = 75 * tan(geometry.deg_to_rad(MIN_GLIDESLOPE_ANGLE))
+
+
+class RunwayEnd(object):
+    """
+    End of the runway allowed for landing: heading, glideslope and its IAF,
+    FAF and FLARE points (each one is a (point, altitude) pair), identifiers
+    for navigation files.
+    """
+
+    def __init__(self, location_name, runway_num, landing_point, opposite_end):
+        """
+        @param location_name Name of the location the runway belongs to.
+        @param runway_num Number of the runway in the location's list.
+        @param landing_point Endpoint to land at (see Location runways).
+        @param opposite_end The other endpoint of the runway.
+        """
+        self.location_name = location_name
+        self.runway_num = runway_num
+        self.landing_point = landing_point
+        self.opposite_end = opposite_end
+        self.heading = geometry.heading(landing_point, opposite_end)
+        self.glideslope_tang = METERS_PER_KILOMETER * tan(
+            geometry.deg_to_rad(max(MIN_GLIDESLOPE_ANGLE, landing_point[3]))
+        )
+        self.iaf = self._glideslope_point(IAF_DISTANCE)
+        self.faf = self._glideslope_point(FAF_DISTANCE)
+        self.flare = self._glideslope_point(FLARE_DISTANCE)
+
+        heading_str = '{:02}'.format(int(round(self.heading / 10)))
+        self.ident = '{} {}'.format(re.sub(r'[^a-zA-Z0-9 ]', '°', location_name), heading_str)
+        if landing_point[3] > 0:
+            self.ident = '{} gs {}'.format(self.ident, landing_point[3])
+        self.short_ident = '{}{}'.format(
+            ''.join(word[0] for word in re.sub(r'([A-Z])', r' \1', location_name).split()),
+            heading_str,
+        )
+        self.opposite_ident = None
+
+    def _glideslope_point(self, distance):
+        alt = self.landing_point[2] + distance * self.glideslope_tang + GLIDESLOPE_ALTITUDE_CORRECTION
+        point = geometry.step_to(self.landing_point, self.opposite_end, -distance)
+        return point, alt
+
+    def __str__(self):
+        return '<RunwayEnd "{}">'.format(self.ident)
+
+
+def make_runway_ends(loc):
+    """Returns all runway ends of the location allowed for landing."""
+    ends = []
+    for runway_num, (ep1, ep2) in enumerate(loc.runways or []):
+        runway_ends = [
+            RunwayEnd(loc.name, runway_num, gs_pt, loc_pt)
+            for gs_pt, loc_pt in [(ep1, ep2), (ep2, ep1)]
+            if gs_pt[3] is not None
+        ]
+        if len(runway_ends) == 2:
+            runway_ends[0].opposite_ident = runway_ends[1].ident
+            runway_ends[1].opposite_ident = runway_ends[0].ident
+        ends.extend(runway_ends)
+    return ends
+
+
+class RunwayCatalog(object):
+    """Runway ends of all given locations."""
+
+    def __init__(self, locations):
+        """
+        @param locations Locations to collect runway ends of, ends themselves
+                         are cached by the locations.
+        """
+        self.ends = [end for loc in locations for end in loc.runway_ends]
+
+    def __iter__(self):
+        return iter(self.ends)
+
+    def __len__(self):
+        return len(self.ends)
@@ -0,0 +1,142 @@
+"""Spatial index for fast nearest and radius queries over Kerbin surface."""
+
+import heapq
+from math import sin, asin, pi
+
+import geometry
+from catalog import LOCATIONS, BEACONS
+
+_INDICES = {}
+
+
+def _chord(dist):
+    """Converts distance along the surface to the chord of the unit sphere."""
+    return 2 * sin(min(dist, geometry.KERBIN_RADIUS * pi) / (2 * geometry.KERBIN_RADIUS))
+
+
+def _surface(chord):
+    """Converts chord of the unit sphere to the distance along the surface."""
+    return 2 * geometry.KERBIN_RADIUS * geometry.bound(asin, chord / 2)
+
+
+class SphereIndex(object):
+    """
+    K-d tree over unit-sphere coordinates of the points. Chord between the
+    points is monotonic with the distance along the surface, so the nearest
+    points in 3D space are the nearest on the surface too.
+    """
+
+    def __init__(self, items):
+        """
+        @param items Iterable of (key, point) pairs, point is given by angle
+                     coordinates (other items of the point are ignored).
+        """
+        self.keys = []
+        self.vectors = []
+        for key, pt in items:
+            self.keys.append(key)
+            self.vectors.append(tuple(geometry.point_on_sphere(pt)))
+        self.root = self._build(range(len(self.keys)), 0)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _build(self, indices, axis):
+        """Builds a subtree, node is a tuple (index, axis, left, right)."""
+        if not indices:
+            return None
+        indices.sort(key=(lambda index: self.vectors[index][axis]))
+        median = len(indices) // 2
+        next_axis = (axis + 1) % 3
+        return (
+            indices[median], axis,
+            self._build(indices[:median], next_axis),
+            self._build(indices[median + 1:], next_axis),
+        )
+
+    def _sq_chord(self, vec, index):
+        other = self.vectors[index]
+        return (vec[0] - other[0]) ** 2 + (vec[1] - other[1]) ** 2 + (vec[2] - other[2]) ** 2
+
+    def nearest(self, pt, count=1):
+        """
+        Returns up to count nearest points as a sorted list of (distance, key)
+        pairs, distance is given along the surface (in kilometres).
+        """
+        vec = tuple(geometry.unit_vector(pt))
+        heap = []  # max-heap by negated squared chords
+
+        def search(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            sq_chord = self._sq_chord(vec, index)
+            if len(heap) < count:
+                heapq.heappush(heap, (-sq_chord, index))
+            elif sq_chord < -heap[0][0]:
+                heapq.heapreplace(heap, (-sq_chord, index))
+            diff = vec[axis] - self.vectors[index][axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            search(near)
+            if len(heap) < count or diff * diff < -heap[0][0]:
+                search(far)
+
+        search(self.root)
+        return [
+            (_surface(sq_chord ** 0.5), self.keys[index])
+            for sq_chord, index in sorted((-neg, index) for neg, index in heap)
+        ]
+
+    def within(self, pt, radius):
+        """
+        Returns all points not further than radius (in kilometres) along the
+        surface as a sorted list of (distance, key) pairs.
+        """
+        vec = tuple(geometry.unit_vector(pt))
+        sq_radius = _chord(radius) ** 2
+        found = []
+
+        def search(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            sq_chord = self._sq_chord(vec, index)
+            if sq_chord <= sq_radius:
+                found.append((sq_chord, index))
+            diff = vec[axis] - self.vectors[index][axis]
+            if diff < 0 or diff * diff <= sq_radius:
+                search(left)
+            if diff >= 0 or diff * diff <= sq_radius:
+                search(right)
+
+        search(self.root)
+        return [(_surface(sq_chord ** 0.5), self.keys[index]) for sq_chord, index in sorted(found)]
+
+
+def locations_index():
+    """Returns the index of all locations (keys are Location objects)."""
+    if 'locations' not in _INDICES:
+        _INDICES['locations'] = SphereIndex((loc, loc.position) for loc in LOCATIONS)
+    return _INDICES['locations']
+
+
+def beacons_index():
+    """Returns the index of all beacons (keys are beacon names)."""
+    if 'beacons' not in _INDICES:
+        _INDICES['beacons'] = SphereIndex(BEACONS.iteritems())
+    return _INDICES['beacons']
+
+
+def reset_indices(*names):
+    """
+    Drops the indices of the given names ("locations", "beacons"; all by
+    default), so they are built again after the catalog is changed.
+    """
+    for name in names or list(_INDICES):
+        _INDICES.pop(name, None)
+
+
+def nearest_beacon(pt):
+    """Returns the name of the nearest beacon and the distance to it."""
+    dist, name = beacons_index().nearest(pt)[0]
+    return name, dist
@@ -1,7 +1,9 @@
 import re
-from math import hypot
+import hashlib
+from math import cos, hypot
 
 import geometry
+import expressions
 
 MAP_WIDTH = 4096
 MAP_HEIGHT = 2048
@@ -16,7 +18,16 @@ MAP_CROSS_HALF_LENGTH = 1.5 * MAP_POINT_RADIUS
 MAP_FONT_SIZE = MAP_POINT_RADIUS * 8
 MAP_ARROWHEAD_LENGTH = 0.01 * min(MAP_WIDTH, MAP_HEIGHT)
 MAP_ARROWHEAD_TANGENT = MAP_ARROWHEAD_LENGTH / 3.0
-MAP_CYCLE = geometry.Vector(MAP_WIDTH, 0)
+MAP_CYCLE = geometry.Vec2(MAP_WIDTH, 0)
+MAP_PATH_TOLERANCE = 0.25  # px, maximum deviation of route curves from route points and midpoints between them
+MAP_PATH_PRECISION = 1  # decimals of coordinates in route paths
+MAP_CORNER_COSINE = cos(geometry.deg_to_rad(10))  # sharper turns of routes split their curves
+MAP_CURVE_REPARAMETRIZE_ERROR = 4  # in tolerances, worse curves are split at once
+MAP_CURVE_ITERATIONS = 4
+
+CONFIG_CHUNK_SIZE = 4096  # number of pieces joined into one chunk of config text
+CONFIG_TOKEN_REGEXP = re.compile(r'[{}]|[^{}]+')
+UTF8_BOM = '\xef\xbb\xbf'
 
 
 def loc_distance(loc1, loc2):
@@ -24,6 +35,15 @@ def loc_distance(loc1, loc2):
     return geometry.distance(loc1.position, loc2.position)
 
 
+def files_hash(paths):
+    """Returns the hash of contents of all given files."""
+    result = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as file:
+            result.update(file.read())
+    return result.hexdigest()
+
+
 def point_to_params(pt, absolute_altitude=False):
     """Returns point coordinates as a list for Contract Configurator waypoint."""
     alt =  pt[2].absolute if absolute_altitude else pt[2].relative
@@ -35,24 +55,102 @@ def point_to_params(pt, absolute_altitude=False):
 def point_on_map(pt):
     """Returns the coordinates of point on the map."""
     normalized_x_angle = (pt[1] - MAP_BASE_LONGITUDE) % 360
-    return geometry.Vector(
+    return geometry.Vec2(
         MAP_WIDTH * normalized_x_angle / 360.0,
         MAP_HEIGHT * (0.5 - pt[0] / 180.0),
     )
 
 
-def write_config(out, node, level=0):
-    """Recursively writes config to the out file."""
-    lf_align = '\n' + '\t' * level
+def iter_config(node, chunk_size=CONFIG_CHUNK_SIZE):
+    """
+    Yields config text by large chunks. Walks the config tree iteratively,
+    without recursion, and reuses indentation strings for every level.
+    """
+    lf_aligns = ['\n']
+    pieces = []
+    stack = [iter(node)]
+    while stack:
+        lf_align = lf_aligns[len(stack) - 1]
+        for param, value in stack[-1]:
+            if isinstance(value, list):
+                pieces.extend((lf_align, param, lf_align, '{'))
+                if len(lf_aligns) == len(stack):
+                    lf_aligns.append(lf_align + '\t')
+                stack.append(iter(value))
+                break
+            pieces.append('{}{} = {}'.format(lf_align, param, value))
+        else:
+            stack.pop()
+            if stack:
+                pieces.extend((lf_aligns[len(stack) - 1], '}'))
+        if len(pieces) >= chunk_size:
+            yield ''.join(pieces)
+            pieces = []
+    pieces.append('\n')
+    yield ''.join(pieces)
+
+
+def write_config(out, node):
+    """Writes config to the out file."""
+    for chunk in iter_config(node):
+        out.write(chunk)
+
+
+def config_to_bytes(node):
+    """Returns config text as a whole (e.g. to hash or compare it)."""
+    return ''.join(iter_config(node))
+
+
+def iter_read_config(lines):
+    """
+    Parses config from the iterable of lines (e.g. file object) and yields its
+    top-level (param, value) pairs as soon as they are read. Nodes are given by
+    lists of pairs in the same form as write_config takes them.
+    """
+    stack = [[]]
+    node_name = None
+    for line_num, line in enumerate(lines, 1):
+        if line_num == 1 and line.startswith(UTF8_BOM):
+            line = line[len(UTF8_BOM):]
+        for token in CONFIG_TOKEN_REGEXP.findall(line.split('//', 1)[0]):
+            if token == '{':
+                node = []
+                stack[-1].append((node_name or '', node))
+                stack.append(node)
+                node_name = None
+            elif token == '}':
+                if len(stack) == 1:
+                    raise ValueError('Unexpected "}}" at line {}'.format(line_num))
+                stack.pop()
+                node_name = None
+            elif '=' in token:
+                param, value = token.split('=', 1)
+                stack[-1].append((param.strip(), value.strip()))
+                node_name = None
+            elif token.strip():
+                node_name = token.strip()
+        if len(stack) == 1 and stack[0]:
+            for pair in stack[0]:
+                yield pair
+            stack[0] = []
+    if len(stack) > 1:
+        raise ValueError('Unexpected end of config, {} node(s) are not closed'.format(len(stack) - 1))
+
+
+def read_config(lines):
+    """Parses the whole config from the iterable of lines (e.g. file object)."""
+    return list(iter_read_config(lines))
+
+
+def find_config_nodes(node, name):
+    """Yields all nodes with the given name from the config tree."""
     for param, value in node:
         if isinstance(value, list):
-            out.write(''.join([lf_align, param, lf_align, '{']))
-            write_config(out, value, level+1)
-            out.write(lf_align + '}')
-        else:
-            out.write('{}{} = {}'.format(lf_align, param, value))
-    if level == 0:
-        out.write('\n')
+            if param == name:
+                yield value
+            else:
+                for found in find_config_nodes(value, name):
+                    yield found
 
 
 def add_route_arrow(route_map, loc1, loc2, beacons=None, **extra):
@@ -60,6 +158,11 @@ def add_route_arrow(route_map, loc1, loc2, beacons=None, **extra):
     Adds a route arrow to SVG map. The route represents real path on the
     surface from the first location to the second.
     """
+    route_map.add(route_map.path(d=route_arrow_path(loc1, loc2, beacons), fill='none', **extra))
+
+
+def route_arrow_path(loc1, loc2, beacons=None):
+    """Returns SVG path data of the route arrow (see add_route_arrow)."""
     pt1 = loc1.position
     pt2 = loc2.position
     dist = geometry.distance(pt1, pt2)
@@ -67,107 +170,445 @@ def add_route_arrow(route_map, loc1, loc2, beacons=None, **extra):
         raise ValueError('Too short route {}, can not draw correctly'.format(dist))
 
     if beacons is None:
-        pt1 = geometry.step_to(pt1, pt2, MAP_ARROW_OFFSET)
-        pt2 = geometry.step_to(pt2, pt1, MAP_ARROW_OFFSET)
-        waypoints = [(False, pt2)]
+        pt1, pt2 = geometry.steps_to([pt1, pt2], [pt2, pt1], [MAP_ARROW_OFFSET] * 2)
+        waypoints = [pt2]
     else:
         start, takeoff = loc1.runways[0]
         last_beacon_position = beacons[-1][1] if beacons else pt1
         touchdown, stop = select_runway(loc2, last_beacon_position)
-        pt1 = geometry.step_to(takeoff, start, -MAP_ARROW_OFFSET)
-        pt2 = geometry.step_to(touchdown, stop, -MAP_ARROW_OFFSET)
-        waypoints = [(True, beacon) for _, beacon in beacons] + [(False, pt2)]
-    path = route_map.path(d=['M'], fill='none', **extra)
-
-    step = None
-    prev_waypoint = pt1
-    prev_pt = point_on_map(pt1)
-    path.push(prev_pt.svg_form())
-    for is_beacon, next_waypoint in waypoints:
-        if is_beacon:
-            prev_vector = geometry.point_on_sphere(prev_waypoint)
-            next_vector = geometry.point_on_sphere(next_waypoint)
-            offset = next_vector + geometry.Vector.cross(next_vector, prev_vector - next_vector)
-            offset_direction = geometry.angles_from_sphere(geometry.Vector.normalize(offset))
-            next_waypoint = geometry.step_to(next_waypoint, offset_direction, MAP_BEACON_OFFSET)
-        for cur_pt in geometry.make_route_points(prev_waypoint, next_waypoint, include_first=False):
-            cur_pt = point_on_map(cur_pt)
-            step = cur_pt - prev_pt
-            cycle_dir = reference = 0
-            if cur_pt[0] > prev_pt[0] + MAP_WIDTH / 2:
-                cycle_dir, reference = 1, 0
-            elif cur_pt[0] < prev_pt[0] - MAP_WIDTH / 2:
-                cycle_dir, reference = -1, MAP_WIDTH
-            if cycle_dir:
-                step -= MAP_CYCLE * cycle_dir
-                extra_part = ((prev_pt + step)[0] - reference) / step[0]
-                intermediate_pt = prev_pt + step * (1 - extra_part)
-                path.push(intermediate_pt.svg_form())
-                intermediate_pt += MAP_CYCLE * cycle_dir
-                path.push('M', intermediate_pt.svg_form())
-            path.push(cur_pt.svg_form())
-            prev_pt = cur_pt
-        prev_waypoint = next_waypoint
-
-    last_step_dir = geometry.Vector.normalize(step)
+        pt1, pt2 = geometry.steps_to([takeoff, touchdown], [start, stop], [-MAP_ARROW_OFFSET] * 2)
+        waypoints = _shift_beacons(pt1, [beacon for _, beacon in beacons]) + [pt2]
+    # Legs are fitted separately, so turns at beacons are kept however slight.
+    legs = [
+        split_at_map_edge(points_on_map(geometry.route_points_array(leg_start, leg_end)))
+        for leg_start, leg_end in zip([pt1] + waypoints[:-1], waypoints)
+    ]
+    cur_pt = geometry.Vec2(*legs[-1][-1][-1])
+    last_step_dir = geometry.Vec2.normalize(cur_pt - geometry.Vec2(*legs[-1][-1][-2]))
+
+    commands = [('M', [legs[0][0][0]])]
+    for segments in legs:
+        for num, segment in enumerate(segments):
+            if num:
+                commands.append(('M', [segment[0]]))
+            commands.extend(('C', curve) for curve in fit_curves(segment))
     arrowhead_base = cur_pt - MAP_ARROWHEAD_LENGTH * last_step_dir
-    arrowhead_tangent = MAP_ARROWHEAD_TANGENT * geometry.Vector(-last_step_dir[1], last_step_dir[0])
-    path.push(
-        (arrowhead_base + arrowhead_tangent).svg_form(),
-        'M', (arrowhead_base - arrowhead_tangent).svg_form(),
-        cur_pt.svg_form(),
+    arrowhead_tangent = MAP_ARROWHEAD_TANGENT * geometry.Vec2(-last_step_dir.y, last_step_dir.x)
+    commands.append(('L', [arrowhead_base + arrowhead_tangent]))
+    commands.append(('M', [arrowhead_base - arrowhead_tangent]))
+    commands.append(('L', [cur_pt]))
+
+    return encode_path(commands)
+
+
+def points_on_map(points):
+    """
+    Returns the coordinates of all points on the map at once as (N, 2) array
+    (list of vectors without NumPy).
+    """
+    numpy = geometry.get_numpy()
+    if numpy is None:
+        return [point_on_map(pt) for pt in points]
+    points = numpy.asarray(points, dtype=float)
+    result = numpy.empty((len(points), 2))
+    result[:, 0] = MAP_WIDTH * ((points[:, 1] - MAP_BASE_LONGITUDE) % 360) / 360.0
+    result[:, 1] = MAP_HEIGHT * (0.5 - points[:, 0] / 180.0)
+    return result
+
+
+def split_at_map_edge(map_points):
+    """
+    Splits the polyline on the map where it crosses the left or the right edge
+    of the map. Returns the list of segments, each of them ends at the edge
+    and the next one starts at the opposite edge.
+    """
+    numpy = geometry.get_numpy()
+    if numpy is None:
+        return _split_at_map_edge_slow(map_points)
+    steps = numpy.diff(map_points, axis=0)
+    cycle_dirs = (steps[:, 0] > MAP_WIDTH / 2).astype(int) - (steps[:, 0] < -MAP_WIDTH / 2)
+    crossings = numpy.flatnonzero(cycle_dirs)
+    if not len(crossings):
+        return [map_points]
+
+    dirs = cycle_dirs[crossings]
+    steps = steps[crossings]
+    steps[:, 0] -= MAP_WIDTH * dirs
+    references = numpy.where(dirs > 0, 0, MAP_WIDTH)
+    prev_pts = map_points[crossings]
+    extra_parts = (prev_pts[:, 0] + steps[:, 0] - references) / steps[:, 0]
+    intermediate_pts = prev_pts + steps * (1 - extra_parts)[:, numpy.newaxis]
+    shifted_pts = intermediate_pts.copy()
+    shifted_pts[:, 0] += MAP_WIDTH * dirs
+
+    segments = numpy.split(map_points, crossings + 1)
+    for num in xrange(len(crossings)):
+        segments[num] = numpy.vstack((segments[num], intermediate_pts[num]))
+        segments[num + 1] = numpy.vstack((shifted_pts[num], segments[num + 1]))
+    return segments
+
+
+def _split_at_map_edge_slow(map_points):
+    """The same as split_at_map_edge, but point by point."""
+    prev_pt = map_points[0]
+    segment = [prev_pt]
+    segments = [segment]
+    for cur_pt in map_points[1:]:
+        cycle_dir = reference = 0
+        if cur_pt.x > prev_pt.x + MAP_WIDTH / 2:
+            cycle_dir, reference = 1, 0
+        elif cur_pt.x < prev_pt.x - MAP_WIDTH / 2:
+            cycle_dir, reference = -1, MAP_WIDTH
+        if cycle_dir:
+            step = cur_pt - prev_pt - MAP_CYCLE * cycle_dir
+            extra_part = (prev_pt.x + step.x - reference) / step.x
+            intermediate_pt = prev_pt + step * (1 - extra_part)
+            segment.append(intermediate_pt)
+            segment = [intermediate_pt + MAP_CYCLE * cycle_dir]
+            segments.append(segment)
+        segment.append(cur_pt)
+        prev_pt = cur_pt
+    return segments
+
+
+def fit_curves(points, tolerance=MAP_PATH_TOLERANCE):
+    """
+    Approximates the polyline by cubic Bezier curves which deviate from its
+    points and midpoints of segments less than tolerance. The polyline is
+    split at sharp corners, then every smooth piece is fitted by Schneider's
+    algorithm. Returns the list of (first control point, second control point,
+    end point) triples, the first curve starts at the first point. Points are
+    given by (N, 2) array or by the list of vectors, points of curves are
+    (x, y) tuples.
+    """
+    points = [(float(x), float(y)) for x, y in points]
+    points = [
+        pt for num, pt in enumerate(points)
+        if num == 0 or hypot(pt[0] - points[num - 1][0], pt[1] - points[num - 1][1]) > 1e-9
+    ]
+    curves = []
+    start = 0
+    for index in _corners(points) + [len(points) - 1]:
+        piece = points[start:index + 1]
+        if len(piece) > 1:
+            curves.extend(_fit_cubic(piece, _end_tangent(piece), _end_tangent(piece[::-1]), tolerance))
+        start = index
+    return curves
+
+
+def _corners(points):
+    """Returns indices of points where the polyline turns sharply."""
+    corners = []
+    for index in xrange(1, len(points) - 1):
+        (x0, y0), (x1, y1), (x2, y2) = points[index - 1:index + 2]
+        dx1, dy1, dx2, dy2 = x1 - x0, y1 - y0, x2 - x1, y2 - y1
+        if dx1 * dx2 + dy1 * dy2 < MAP_CORNER_COSINE * hypot(dx1, dy1) * hypot(dx2, dy2):
+            corners.append(index)
+    return corners
+
+
+def _unit(x, y):
+    length = hypot(x, y)
+    return x / length, y / length
+
+
+def _end_tangent(points):
+    """
+    Returns unit tangent at the first point directed into the polyline. It is
+    estimated by the parabola through three first points if they are smooth.
+    """
+    (x0, y0), (x1, y1) = points[:2]
+    direction = _unit(x1 - x0, y1 - y0)
+    if len(points) < 3:
+        return direction
+    x2, y2 = points[2]
+    step1, step2 = hypot(x1 - x0, y1 - y0), hypot(x2 - x1, y2 - y1)
+    coef0 = -(2 * step1 + step2) / (step1 * (step1 + step2))
+    coef1 = (step1 + step2) / (step1 * step2)
+    coef2 = -step1 / (step2 * (step1 + step2))
+    tangent = (coef0 * x0 + coef1 * x1 + coef2 * x2, coef0 * y0 + coef1 * y1 + coef2 * y2)
+    if tangent[0] * direction[0] + tangent[1] * direction[1] <= 0:
+        return direction
+    return _unit(*tangent)
+
+
+def _fit_cubic(points, tangent1, tangent2, tolerance):
+    """
+    Fits points by one cubic curve with given unit tangents at its ends (both
+    directed into the curve) or splits them at the worst point recursively.
+    """
+    (x0, y0), (x3, y3) = points[0], points[-1]
+    if len(points) == 2:
+        dist = hypot(x3 - x0, y3 - y0) / 3
+        return [(
+            (x0 + dist * tangent1[0], y0 + dist * tangent1[1]),
+            (x3 + dist * tangent2[0], y3 + dist * tangent2[1]),
+            points[-1],
+        )]
+
+    params = _chord_params(points)
+    curve = _bezier_by_tangents(points, params, tangent1, tangent2)
+    error, split = _max_curve_error(points, params, curve)
+    if tolerance < error < MAP_CURVE_REPARAMETRIZE_ERROR * tolerance:
+        for _ in xrange(MAP_CURVE_ITERATIONS):
+            params = [_newton_param(curve, pt, param) for pt, param in zip(points, params)]
+            curve = _bezier_by_tangents(points, params, tangent1, tangent2)
+            error, split = _max_curve_error(points, params, curve)
+            if error <= tolerance:
+                break
+    if error <= tolerance:
+        return [curve[1:]]
+
+    (xp, yp), (xn, yn) = points[split - 1], points[split + 1]
+    center = _unit(xp - xn, yp - yn) if (xp, yp) != (xn, yn) else tangent2
+    return (
+        _fit_cubic(points[:split + 1], tangent1, center, tolerance)
+        + _fit_cubic(points[split:], (-center[0], -center[1]), tangent2, tolerance)
+    )
+
+
+def _chord_params(points):
+    """Returns parameters of points proportional to the length along the polyline."""
+    lengths = [0.0]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        lengths.append(lengths[-1] + hypot(x1 - x0, y1 - y0))
+    return [length / lengths[-1] for length in lengths]
+
+
+def _bezier_by_tangents(points, params, tangent1, tangent2):
+    """
+    Returns control points of the cubic curve with given ends and tangents
+    whose lengths minimize squared distances to points by their parameters.
+    """
+    (x0, y0), (x3, y3) = points[0], points[-1]
+    (tx1, ty1), (tx2, ty2) = tangent1, tangent2
+    c00 = c01 = c11 = rhs1 = rhs2 = 0.0
+    for (x, y), param in zip(points, params):
+        rest = 1 - param
+        b0, b1, b2, b3 = rest * rest * rest, 3 * rest * rest * param, 3 * rest * param * param, param * param * param
+        ax1, ay1, ax2, ay2 = tx1 * b1, ty1 * b1, tx2 * b2, ty2 * b2
+        c00 += ax1 * ax1 + ay1 * ay1
+        c01 += ax1 * ax2 + ay1 * ay2
+        c11 += ax2 * ax2 + ay2 * ay2
+        rest_x = x - x0 * (b0 + b1) - x3 * (b2 + b3)
+        rest_y = y - y0 * (b0 + b1) - y3 * (b2 + b3)
+        rhs1 += ax1 * rest_x + ay1 * rest_y
+        rhs2 += ax2 * rest_x + ay2 * rest_y
+
+    length = hypot(x3 - x0, y3 - y0)
+    det = c00 * c11 - c01 * c01
+    alpha1 = alpha2 = 0
+    if abs(det) > 1e-12:
+        alpha1 = (rhs1 * c11 - rhs2 * c01) / det
+        alpha2 = (c00 * rhs2 - c01 * rhs1) / det
+    if alpha1 < 1e-6 * length or alpha2 < 1e-6 * length:
+        alpha1 = alpha2 = length / 3
+    return (
+        points[0], (x0 + alpha1 * tx1, y0 + alpha1 * ty1),
+        (x3 + alpha2 * tx2, y3 + alpha2 * ty2), points[-1],
     )
 
-    route_map.add(path)
+
+def _bezier_point(curve, param):
+    rest = 1 - param
+    b0, b1, b2, b3 = rest * rest * rest, 3 * rest * rest * param, 3 * rest * param * param, param * param * param
+    (x0, y0), (x1, y1), (x2, y2), (x3, y3) = curve
+    return b0 * x0 + b1 * x1 + b2 * x2 + b3 * x3, b0 * y0 + b1 * y1 + b2 * y2 + b3 * y3
+
+
+def _midpoint(points, index):
+    """
+    Returns the point of the smooth line through the polyline between its
+    points index - 1 and index, interpolated by the cubic (or parabola at the
+    ends) through the neighbouring points.
+    """
+    (x1, y1), (x2, y2) = points[index - 1], points[index]
+    if len(points) < 3:
+        return 0.5 * (x1 + x2), 0.5 * (y1 + y2)
+    if index == 1:
+        x3, y3 = points[2]
+        return (3 * x1 + 6 * x2 - x3) / 8, (3 * y1 + 6 * y2 - y3) / 8
+    x0, y0 = points[index - 2]
+    if index == len(points) - 1:
+        return (-x0 + 6 * x1 + 3 * x2) / 8, (-y0 + 6 * y1 + 3 * y2) / 8
+    x3, y3 = points[index + 1]
+    return (-x0 + 9 * x1 + 9 * x2 - x3) / 16, (-y0 + 9 * y1 + 9 * y2 - y3) / 16
+
+
+def _max_curve_error(points, params, curve):
+    """
+    Returns the maximum distance of the curve from inner points and from the
+    middles between points (so the curve can not bulge between them) and the
+    index of the inner point to split at.
+    """
+    max_error, max_index = 0, len(points) // 2
+    for index in xrange(1, len(points)):
+        (x0, y0), (x1, y1) = points[index - 1], points[index]
+        xm, ym = _midpoint(points, index)
+        x, y = _bezier_point(curve, 0.5 * (params[index - 1] + params[index]))
+        # Only the offset across the segment counts, parameters of the middles are rough.
+        error = abs((x - xm) * (y1 - y0) - (y - ym) * (x1 - x0)) / hypot(x1 - x0, y1 - y0)
+        if index < len(points) - 1:
+            x, y = _bezier_point(curve, params[index])
+            error = max(error, hypot(x - x1, y - y1))
+        if error > max_error:
+            max_error, max_index = error, min(index, len(points) - 2)
+    return max_error, max_index
+
+
+def _newton_param(curve, pt, param):
+    """Improves the parameter of the point on the curve by Newton's method."""
+    (x0, y0), (x1, y1), (x2, y2), (x3, y3) = curve
+    rest = 1 - param
+    x, y = _bezier_point(curve, param)
+    offset_x, offset_y = x - pt[0], y - pt[1]
+    d1, d2, d3 = 3 * rest * rest, 6 * rest * param, 3 * param * param
+    dx = d1 * (x1 - x0) + d2 * (x2 - x1) + d3 * (x3 - x2)
+    dy = d1 * (y1 - y0) + d2 * (y2 - y1) + d3 * (y3 - y2)
+    ddx = 6 * rest * (x2 - 2 * x1 + x0) + 6 * param * (x3 - 2 * x2 + x1)
+    ddy = 6 * rest * (y2 - 2 * y1 + y0) + 6 * param * (y3 - 2 * y2 + y1)
+    denominator = dx * dx + dy * dy + offset_x * ddx + offset_y * ddy
+    if denominator == 0:
+        return param
+    return min(1.0, max(0.0, param - (offset_x * dx + offset_y * dy) / denominator))
+
+
+def _format_fixed(value, precision):
+    """Formats integer number of 10^-precision units with trailing zeros dropped."""
+    if not precision:
+        return str(value)
+    sign = '-' if value < 0 else ''
+    text = str(abs(value)).rjust(precision + 1, '0')
+    whole, fraction = text[:-precision], text[-precision:].rstrip('0')
+    return sign + whole + ('.' + fraction if fraction else '')
+
+
+def encode_path(commands, precision=MAP_PATH_PRECISION):
+    """
+    Returns SVG path data for the list of (command, points) pairs, where
+    command is "M", "L" or "C" and points are absolute. Coordinates are
+    rounded to the given number of decimals and written by relative commands,
+    deltas are taken between rounded points so the rounding error does not
+    add up. The command letter is omitted when it repeats.
+    """
+    scale = 10 ** precision
+    result = []
+    prev = (0, 0)
+    prev_command = None
+    for command, points in commands:
+        points = [(int(round(x * scale)), int(round(y * scale))) for x, y in points]
+        letter = 'M' if not result else command.lower()
+        if letter != prev_command:
+            result.append(letter)
+            prev_command = 'l' if letter == 'm' else letter
+        result.append(' '.join(
+            '{},{}'.format(_format_fixed(x - prev[0], precision), _format_fixed(y - prev[1], precision))
+            for x, y in points
+        ))
+        prev = points[-1]
+    return ' '.join(result)
+
+
+def _shift_beacons(start, beacons):
+    """
+    Returns positions of the route arrow near the beacons: each one is shifted
+    aside from the beacon to keep the beacon mark itself clean.
+    """
+    offset_directions = []
+    prev_vector = geometry.unit_vector(start)
+    for next_vector in geometry.points_on_sphere(beacons):
+        next_vector = geometry.Vec3(*next_vector)
+        offset = next_vector + geometry.Vec3.cross(next_vector, prev_vector - next_vector)
+        offset_directions.append(geometry.angles_from_sphere(geometry.Vec3.normalize(offset)))
+        prev_vector = next_vector
+    return list(geometry.steps_to(beacons, offset_directions, [MAP_BEACON_OFFSET] * len(beacons)))
 
 
 def add_beacon(route_map, pt):
     """Adds a beacon mark to SVG map."""
-    path = []
-    for cross_leg in [
-        geometry.Vector(MAP_CROSS_HALF_LENGTH, MAP_CROSS_HALF_LENGTH),
-        geometry.Vector(MAP_CROSS_HALF_LENGTH, -MAP_CROSS_HALF_LENGTH),
-    ]:
-        path.extend(['M', (pt - cross_leg).svg_form(), (pt + cross_leg).svg_form()])
     route_map.add(route_map.path(
-        d=path, fill='none', stroke='black', stroke_width='{}px'.format(MAP_CROSS_LINE_WIDTH),
+        d=beacon_mark_path(pt), fill='none', stroke='black', stroke_width='{}px'.format(MAP_CROSS_LINE_WIDTH),
     ))
 
 
-def select_runway(loc, approach_pt):
-    """Returns best runway of location for approach from the specified point."""
+def beacon_mark_path(pt):
+    """Returns SVG path data of the beacon mark (see add_beacon)."""
+    commands = []
+    for cross_leg in [
+        geometry.Vec2(MAP_CROSS_HALF_LENGTH, MAP_CROSS_HALF_LENGTH),
+        geometry.Vec2(MAP_CROSS_HALF_LENGTH, -MAP_CROSS_HALF_LENGTH),
+    ]:
+        commands.extend([('M', [pt - cross_leg]), ('L', [pt + cross_leg])])
+    return encode_path(commands)
+
+
+def select_runway_end(loc, approach_pt):
+    """Returns best runway end of location for approach from the specified point."""
     min_diff = result = None
-    for ep1, ep2 in loc.runways:
-        for gs_pt, loc_pt in [(ep1, ep2), (ep2, ep1)]:
-            if gs_pt[3] is None:
-                continue
-            rw_hdg = geometry.heading(gs_pt, loc_pt)
-            appr_hdg = (geometry.heading(gs_pt, approach_pt) + 180) % 360
-            hdg_diff = min(abs(rw_hdg-appr_hdg), 360+rw_hdg-appr_hdg, 360+appr_hdg-rw_hdg)
-            if min_diff is None or hdg_diff < min_diff:
-                min_diff, result = hdg_diff, (gs_pt, loc_pt)
+    for runway_end in loc.runway_ends:
+        rw_hdg = runway_end.heading
+        appr_hdg = (geometry.heading(runway_end.landing_point, approach_pt) + 180) % 360
+        hdg_diff = min(abs(rw_hdg-appr_hdg), 360+rw_hdg-appr_hdg, 360+appr_hdg-rw_hdg)
+        if min_diff is None or hdg_diff < min_diff:
+            min_diff, result = hdg_diff, runway_end
     return result
 
 
+def select_runway(loc, approach_pt):
+    """
+    Returns best runway of location for approach from the specified point as
+    a pair of its landing point and its opposite end.
+    """
+    runway_end = select_runway_end(loc, approach_pt)
+    return runway_end.landing_point, runway_end.opposite_end
+
+
+def contract_variables(contract):
+    """
+    Returns intervals of contract variables used in reward strings, by their
+    names (without "@/" prefix).
+    """
+    variables = {'needSecondCrewMember': (0, 1)}
+    passengers_number = getattr(contract, 'passengers_number', None)
+    if isinstance(passengers_number, int):
+        passengers_number = (passengers_number, passengers_number)
+    if passengers_number is not None:
+        variables['passengersNum'] = tuple(float(num) for num in passengers_number)
+    return variables
+
+
+def calculate_reward_bounds(contract, reward_string):
+    """
+    Calculates min and max reward using the reward string from contract
+    description. The string is compiled only once.
+    """
+    expression = expressions.compile_expression(reward_string)
+    min_reward, max_reward = expression.bounds(contract_variables(contract))
+    return int(min_reward), int(max_reward)
+
+
+def sample_rewards(contract, reward_string, count, rnd):
+    """
+    Returns NumPy array with count random rewards for the reward string from
+    contract description. Passengers number is sampled like Contract
+    Configurator does it: max of the interval is excluded.
+    """
+    numpy = geometry.get_numpy()
+    variables = {'needSecondCrewMember': rnd.randint(0, 2, size=count)}
+    passengers_number = getattr(contract, 'passengers_number', None)
+    if isinstance(passengers_number, int):
+        variables['passengersNum'] = numpy.full(count, passengers_number)
+    elif passengers_number is not None:
+        variables['passengersNum'] = rnd.randint(passengers_number[0], passengers_number[1], size=count)
+    return expressions.compile_expression(reward_string).sample_array(variables, count, rnd)
+
+
 def calculate_reward(contract, reward_string, calc_min):
     """
     Function to calculate min or max reward using the reward string from
-    contract description. Yes, it's really crazy. Don't blame me, please.
-    """
-    def Random(first, second):
-        func = (min if calc_min else max)
-        return func(float(first), float(second))
-
-    if 'needSecondCrewMember' in reward_string:
-        reward_string = reward_string.replace('@/needSecondCrewMember', '0' if calc_min else '1')
-    if 'passengersNum' in reward_string:
-        reward_string = reward_string.replace(
-            '@/passengersNum',
-            'Random({}, {})'.format(contract.passengers_number[0], contract.passengers_number[1]),
-        )
-
-    assert '@/' not in reward_string, 'Some variable is unknown in "{}"'.format(reward_string)
-    return int(eval(reward_string))
+    contract description.
+    """
+    return calculate_reward_bounds(contract, reward_string)[0 if calc_min else 1]
 
 
 def normalize_flight_description(description):
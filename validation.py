@@ -0,0 +1,97 @@
+"""
+Batch validation of the catalog: locations, routes and their contracts. All
+problems are collected and reported together, a successful validation is
+remembered until sources of the catalog change.
+"""
+
+import os
+import glob
+from itertools import chain, groupby
+
+import utils
+import geometry
+from registry import REGISTRY
+from catalog import ROUTES, BEACONS
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(SOURCE_DIR, '.cache')
+# Sources defining the catalog and its checks.
+SOURCE_FILES = (
+    'locations.py', 'routes.py', 'beacons.py',
+    'classes.py', 'geometry.py', 'catalog.py', 'registry.py', 'validation.py',
+)
+
+
+def location_errors(locations):
+    """
+    Checks that aircraft launch point of every location is the nearest to
+    the first runway endpoint. Distances are calculated in one batch.
+    """
+    pairs = [
+        (loc, pt)
+        for loc in locations
+        if loc.aircraft_launch is not None and loc.runways
+        for pt in chain.from_iterable(loc.runways)
+    ]
+    dists = geometry.distances([loc.aircraft_launch for loc, _ in pairs], [pt for _, pt in pairs])
+    errors = []
+    for loc, loc_dists in groupby(zip(pairs, dists), key=(lambda item: item[0][0])):
+        loc_dists = [dist for _, dist in loc_dists]
+        if loc_dists[0] != min(loc_dists):
+            errors.append('Mismatch aircraft_launch and runways for {}'.format(loc.name))
+    return errors
+
+
+def route_errors(routes, registry=REGISTRY):
+    """Checks locations and beacons of routes and requirements of their contracts."""
+    errors = registry.route_errors(routes)
+    for route, contract in sorted(routes.iteritems()):
+        errors.extend(
+            'unknown beacon "{}" in route {} -> {}'.format(name, *route)
+            for name in contract.beacon_names
+            if name not in BEACONS
+        )
+        if route[0] in registry and route[1] in registry:
+            errors.extend(
+                '{} from "{}" to "{}" is incorrect: {}'.format(contract.__class__.__name__, route[0], route[1], error)
+                for error in contract.get_location_errors(registry[route[0]], registry[route[1]])
+            )
+    return errors
+
+
+def catalog_errors():
+    """Returns all problems of the catalog."""
+    return location_errors(REGISTRY) + route_errors(ROUTES)
+
+
+def validate_catalog(force=False):
+    """
+    Validates the catalog unless it is validated already with the same
+    sources, raises ValueError with all found problems. Returns True if the
+    validation has been performed.
+    @param force Validate anyway and do not remember the result (for the
+                 catalog changed in memory).
+    """
+    stamp = os.path.join(CACHE_DIR, 'validated-{}'.format(
+        utils.files_hash(os.path.join(SOURCE_DIR, name) for name in SOURCE_FILES),
+    ))
+    if not force and os.path.exists(stamp):
+        return False
+    errors = catalog_errors()
+    if errors:
+        raise ValueError('Catalog has {} problem(s):\n  {}'.format(len(errors), '\n  '.join(errors)))
+    if not force:
+        _save_stamp(stamp)
+    return True
+
+
+def _save_stamp(stamp):
+    """Writes the stamp replacing stale ones, failures are not fatal."""
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        for stale_stamp in glob.glob(os.path.join(CACHE_DIR, 'validated-*')):
+            os.remove(stale_stamp)
+        open(stamp, 'w').close()
+    except (IOError, OSError):
+        pass
@@ -7,6 +7,8 @@ import os
 import sys
 import argparse
 
+import utils
+
 PATTERNS = [
     'name', 'latitude', 'longitude', 'altitude',
 ]
@@ -17,19 +19,12 @@ def main():
     parser.add_argument('file', metavar='FILE', type=str, help='File to parse.')
     options = parser.parse_args()
 
-    waypoints = []
     with open(options.file) as file:
-        config = file.read()
-    for wp_config in config.split('WAYPOINT'):
-        wp_info = (
-            line.strip()
-            for line in wp_config.split('\n')
-            if any(pattern in line for pattern in PATTERNS)
-        )
-        waypoints.append(dict(
-            [s.strip() for s in line.split('=')]
-            for line in wp_info
-        ))
+        config = utils.read_config(file)
+    waypoints = [
+        dict((param, value) for param, value in wp_config if param in PATTERNS)
+        for wp_config in utils.find_config_nodes(config, 'WAYPOINT')
+    ]
 
     waypoints_info = {}
     for waypoint in waypoints: